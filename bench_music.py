@@ -0,0 +1,281 @@
+"""Offline benchmark for the music pipeline.
+
+yt-dlp is replaced by a stub extractor with a fixed simulated network
+latency, and Discord by a dummy voice client that "plays" each track for a
+fixed time. Results are printed as JSON so they can be compared between
+builds:
+
+    python bench_music.py --guilds 20 --output bench.json
+    python bench_music.py --baseline bench.json
+"""
+import sys
+import json
+import time
+import types
+import asyncio
+import argparse
+import hashlib
+import statistics
+from typing import Dict, List, Optional
+
+try:
+    import yt_dlp  # noqa: F401
+except ImportError:
+    # Only the stub below is used, so the real package is not needed
+    sys.modules['yt_dlp'] = types.ModuleType('yt_dlp')
+    sys.modules['yt_dlp'].YoutubeDL = None
+
+import music
+from music import AudioCache, MusicQueue, Prefetcher, Track
+
+
+class StubYoutubeDL:
+    """Stands in for yt_dlp.YoutubeDL, answering searches and stream lookups after `latency` seconds"""
+
+    latency = 0.05
+    calls = 0
+
+    def __init__(self, options: dict):
+        self.options = options
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_info(self, query: str, download: bool = False) -> dict:
+        StubYoutubeDL.calls += 1
+        time.sleep(self.latency)
+        if query.startswith('ytsearch:'):
+            video = hashlib.md5(query.encode()).hexdigest()[:11]
+            return {'entries': [{'id': video, 'title': query[len('ytsearch:'):], 'duration': 180}]}
+        video = music.video_id(query)
+        expires = int(time.time()) + 6 * 60 * 60
+        return {
+            'url': f"https://stub.invalid/audio/{video}?expire={expires}",
+            'format_id': '251',
+            'ext': 'webm',
+            'acodec': 'opus',
+            'abr': 160,
+            'asr': 48000,
+            'protocol': 'https',
+            'title': video,
+            'duration': 180
+        }
+
+
+class DummyVoiceClient:
+    """Plays each source for `track_length` seconds and records when playback starts and ends"""
+
+    def __init__(self, track_length: float):
+        self.track_length = track_length
+        self.playing = False
+        self.last_end: Optional[float] = None
+        self.handoffs: List[float] = []
+
+    def is_playing(self) -> bool:
+        return self.playing
+
+    def is_paused(self) -> bool:
+        return False
+
+    def is_connected(self) -> bool:
+        return True
+
+    def play(self, source: dict, after=None):
+        now = time.perf_counter()
+        if self.last_end is not None:
+            self.handoffs.append(now - self.last_end)
+        self.playing = True
+        asyncio.get_running_loop().call_later(self.track_length, self._finish, after)
+
+    def _finish(self, after):
+        self.playing = False
+        self.last_end = time.perf_counter()
+        if after:
+            after(None)
+
+
+def reset_caches():
+    music.track_cache = music.TTLCache(music.TRACK_CACHE_SIZE, music.TRACK_CACHE_TTL)
+    music.stream_cache = music.StreamCache()
+    StubYoutubeDL.calls = 0
+
+
+def summarize(samples: List[float]) -> dict:
+    """Latency statistics in milliseconds"""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+        'p50_ms': round(ordered[len(ordered) // 2] * 1000, 3),
+        'p95_ms': round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3)
+    }
+
+
+async def bench_search(guilds: int, queries: int) -> dict:
+    """Time find_track for unique queries, then for the same queries again"""
+    reset_caches()
+
+    async def timed(query: str) -> float:
+        start = time.perf_counter()
+        await music.find_track(query)
+        return time.perf_counter() - start
+
+    names = [[f"guild {g} song {i}" for i in range(queries)] for g in range(guilds)]
+
+    async def run() -> List[float]:
+        # Each guild searches one song at a time, all guilds at once
+        async def guild(songs: List[str]) -> List[float]:
+            return [await timed(song) for song in songs]
+        results = await asyncio.gather(*(guild(songs) for songs in names))
+        return [sample for samples in results for sample in samples]
+
+    cold = await run()
+    cold_calls = StubYoutubeDL.calls
+    warm = await run()
+    return {
+        'cold': summarize(cold),
+        'warm': summarize(warm),
+        'extractor_calls': cold_calls,
+        'warm_extractor_calls': StubYoutubeDL.calls - cold_calls
+    }
+
+
+# Without a cache directory nothing is on disk, so every track is streamed
+audio_cache = AudioCache(directory=None)
+
+
+class BenchGuild:
+    def __init__(self, depth: int, track_length: float):
+        self.queue = MusicQueue()
+        self.prefetcher = Prefetcher(depth=depth)
+        self.voice = DummyVoiceClient(track_length)
+        self.done = asyncio.Event()
+
+
+async def play_next(guild: BenchGuild):
+    """bot.play_next with the dummy voice client, sharing its music.play_next_track step"""
+    def start(stream: Optional[dict], cached_path: Optional[str]) -> bool:
+        if not guild.voice.is_connected() or guild.voice.is_playing():
+            return False
+        guild.voice.play(stream, after=lambda e: asyncio.ensure_future(play_next(guild)))
+        return True
+
+    if not await music.play_next_track(guild.queue, guild.prefetcher, start, audio_cache):
+        guild.done.set()
+
+
+async def bench_handoff(guilds: int, tracks: int, track_length: float, depth: int) -> dict:
+    """Time from one track ending to the next one starting, with `depth` tracks prefetched"""
+    reset_caches()
+    bench_guilds = [BenchGuild(depth, track_length) for _ in range(guilds)]
+    for g, guild in enumerate(bench_guilds):
+        guild.queue.extend(Track(f"g{g:04d}t{i:05d}") for i in range(tracks))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(play_next(guild) for guild in bench_guilds))
+    await asyncio.gather(*(guild.done.wait() for guild in bench_guilds))
+    elapsed = time.perf_counter() - start
+    return {
+        'prefetch_depth': depth,
+        'handoff': summarize([sample for guild in bench_guilds for sample in guild.voice.handoffs]),
+        'wall_s': round(elapsed, 3),
+        'extractor_calls': StubYoutubeDL.calls
+    }
+
+
+def bench_queue(guilds: int, tracks: int) -> dict:
+    """Operations per second for the queue operations behind /play, /queue, /qmove, /qremove and /shuffle"""
+    queues = [MusicQueue() for _ in range(guilds)]
+    batch = [Track(f"t{i:05d}") for i in range(tracks)]
+    results: Dict[str, float] = {}
+
+    def measure(name: str, operation, repeat: int):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for queue in queues:
+                operation(queue)
+        elapsed = time.perf_counter() - start
+        results[name] = round(repeat * len(queues) / elapsed) if elapsed else 0
+
+    for track in batch:
+        for queue in queues:
+            queue.add(track)
+    measure('page', lambda queue: queue.page(len(queue) // 20 + 1), 200)
+    measure('move', lambda queue: queue.move(len(queue) - 1, 0), 200)
+    measure('shuffle', lambda queue: queue.shuffle(), 20)
+    measure('remove_range', lambda queue: queue.remove_range(1, 2), min(tracks // 2, 200))
+    measure('pop', lambda queue: queue.pop(), min(tracks // 2, 200))
+    measure('add', lambda queue: queue.add(batch[0]), 1000)
+    return {'ops_per_s': results, 'queue_length': tracks}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """List p50/p95 latencies that got more than `tolerance` slower than the baseline"""
+    regressions = []
+
+    def walk(current, previous, path):
+        if isinstance(current, dict) and isinstance(previous, dict):
+            for key, value in current.items():
+                if key in previous:
+                    walk(value, previous[key], f"{path}.{key}" if path else key)
+        elif (path.endswith(('p50_ms', 'p95_ms')) and current > previous * (1 + tolerance)
+              and current - previous > 1):
+            # The 1 ms floor keeps timer noise on cache hits from counting as a regression
+            regressions.append(f"{path}: {previous} -> {current}")
+
+    walk(results, baseline, '')
+    return regressions
+
+
+async def run(args) -> dict:
+    StubYoutubeDL.latency = args.latency
+    return {
+        'config': {
+            'guilds': args.guilds,
+            'tracks': args.tracks,
+            'latency_s': args.latency,
+            'track_length_s': args.track_length,
+            'extractor_workers': music.MUSIC_WORKERS
+        },
+        'search': await bench_search(args.guilds, args.tracks),
+        'handoff': await bench_handoff(args.guilds, args.tracks, args.track_length, music.PREFETCH_DEPTH),
+        'handoff_no_prefetch': await bench_handoff(args.guilds, args.tracks, args.track_length, 0),
+        'queue': bench_queue(args.guilds, args.queue_length)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the music pipeline offline")
+    parser.add_argument('--guilds', type=int, default=10, help="Simulated guilds playing at once")
+    parser.add_argument('--tracks', type=int, default=10, help="Tracks searched and played per guild")
+    parser.add_argument('--latency', type=float, default=0.05, help="Simulated yt-dlp latency in seconds")
+    parser.add_argument('--track-length', type=float, default=0.2, help="Simulated track length in seconds")
+    parser.add_argument('--queue-length', type=int, default=1000, help="Queue length for the queue benchmark")
+    parser.add_argument('--output', help="Also write the results to this file")
+    parser.add_argument('--baseline', help="Results file to compare latencies against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed slowdown before failing")
+    args = parser.parse_args()
+
+    music.YoutubeDL = StubYoutubeDL
+    results = asyncio.run(run(args))
+    if args.baseline:
+        with open(args.baseline) as f:
+            results['regressions'] = compare(results, json.load(f), args.tolerance)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    if results.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,17 +5,22 @@ import os
 import random
 import asyncio
 import aiohttp
-import yt_dlp
 import io
 import base64
-from typing import Optional, List
-from yt_dlp import YoutubeDL
+from typing import Optional, List, Tuple
+from discord import FFmpegOpusAudio, FFmpegPCMAudio
+from discord.utils import get
 import sys
-from games import TicTacToe, Hangman, GuessTheNumber, Battleship
+from games import TicTacToe, Hangman, GuessTheNumber, Battleship, GameRegistry
+from words import DIFFICULTIES, load_corpus
+from render import BoardRenderer
 from PIL import Image
 from io import BytesIO
 import json
-import ollama
+from music import (MusicQueue, Prefetcher, fill_tracks, find_track, format_duration,
+                   is_playlist, load_playlist, play_next_track, prefetch_queue)
+from llm import (ResponseCache, SingleFlight, RequestScheduler, QueueFullError,
+                 ConversationMemory, cache_key, default_router)
 
 # Load environment variables from .env file
 try:
@@ -58,113 +63,482 @@ def is_owner():
     return app_commands.check(predicate)
 
 # Global variables
-active_games = {}
-queues = {}
-current_song = {}
+GAME_IDLE_TIMEOUT = float(os.getenv('GAME_IDLE_TIMEOUT', 15 * 60))  # Seconds before an abandoned game is closed
+GAME_SWEEP_INTERVAL = float(os.getenv('GAME_SWEEP_INTERVAL', 30))
+RENDER_BOARDS = os.getenv('RENDER_BOARDS', 'true').lower() == 'true'  # Send game boards as images
+queues = {}  # Guild ID -> MusicQueue
+prefetchers = {}  # Per-guild stream URL prefetch for upcoming tracks
+playback_locks = {}  # Guild ID -> lock held while the next track is being started
+playlist_fills = {}  # Guild ID -> background tasks filling in imported playlist tracks
 FFMPEG_OPTIONS = {
     'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
     'options': '-vn'
 }
+OPUS_PASSTHROUGH = os.getenv('OPUS_PASSTHROUGH', 'true').lower() == 'true'
+VOICE_IDLE_TIMEOUT = float(os.getenv('VOICE_IDLE_TIMEOUT', 300))  # Seconds without playback before leaving
+VOICE_EMPTY_TIMEOUT = float(os.getenv('VOICE_EMPTY_TIMEOUT', 30))  # Seconds alone in a channel before leaving
+VOICE_CHECK_INTERVAL = float(os.getenv('VOICE_CHECK_INTERVAL', 15))
+QUEUE_PAGE_SIZE = 10
+LLM_STREAMING = os.getenv('LLM_STREAMING', 'true').lower() == 'true'
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', 1.0))  # Seconds between message edits
+EMBED_DESCRIPTION_LIMIT = 4096
+LONG_MESSAGE_MAX_CALLS = int(os.getenv('LONG_MESSAGE_MAX_CALLS', 3))  # Beyond this, answers are attached as a file
+
+def split_markdown(text: str, limit: int = 2000) -> List[str]:
+    """Split markdown into chunks of at most `limit` characters.
+
+    Breaks fall on paragraph or line boundaries where possible, and a code
+    block that has to be cut is closed and re-opened in the next chunk.
+    """
+    # Pre-split lines that could never fit, leaving room for fences
+    width = limit - 32
+    lines = []
+    for line in text.split("\n"):
+        while len(line) > width:
+            cut = line.rfind(" ", width // 2, width)
+            cut = width if cut == -1 else cut + 1
+            lines.append(line[:cut])
+            line = line[cut:]
+        lines.append(line)
+
+    chunks = []
+    current = []  # (line, open fence before the line)
+    size = 0
+    fence = None
+    for line in lines:
+        is_fence = line.strip().startswith("```")
+        fence_after = (None if fence else line.strip()) if is_fence else fence
+        # Leave room to close a code block that is still open after this line
+        while current and size + len(line) + 1 + (4 if fence_after else 0) > limit:
+            # Prefer the last paragraph break outside a code block
+            breaks = [i for i, (l, f) in enumerate(current)
+                      if i > len(current) // 2 and not l.strip() and f is None]
+            if breaks:
+                chunks.append("\n".join(l for l, _ in current[:breaks[-1]]))
+                current = current[breaks[-1] + 1:]
+                size = sum(len(l) + 1 for l, _ in current)
+                continue
+            last, last_fence = current[-1]
+            if len(current) > 1 and last_fence is None and last.strip().startswith("```"):
+                # Never end a chunk on an opening fence, move it to the next chunk instead
+                chunks.append("\n".join(l for l, _ in current[:-1]))
+                current = [(last, None)]
+            else:
+                chunks.append("\n".join(l for l, _ in current) + ("\n```" if fence else ""))
+                current = [(fence, None)] if fence else []
+            size = sum(len(l) + 1 for l, _ in current)
+            break
+
+        current.append((line, fence))
+        size += len(line) + 1
+        fence = fence_after
+
+    if current:
+        chunks.append("\n".join(l for l, _ in current))
+    return [chunk.strip("\n") for chunk in chunks if chunk.strip()]
+
+async def send_markdown(send, text: str, max_length: int = 2000):
+    """Send markdown in as few API calls as possible.
+
+    Short text goes out as a plain message. Longer text is packed into
+    embeds (up to 10 per message and 6000 characters in total), and if
+    that would still take more than LONG_MESSAGE_MAX_CALLS messages the
+    full text is attached as a file instead.
+    """
+    if len(text) <= max_length:
+        return await send(text)
+
+    def pack(limit: int) -> List[List[str]]:
+        # Group embed-sized chunks into as few messages as Discord allows
+        calls = [[]]
+        for chunk in split_markdown(text, limit):
+            if len(calls[-1]) == 10 or sum(map(len, calls[-1])) + len(chunk) > 6000:
+                calls.append([])
+            calls[-1].append(chunk)
+        return calls
+
+    # Full-size embeds only fit one per message, so also try two per message
+    calls = min(pack(EMBED_DESCRIPTION_LIMIT), pack(3000), key=len)
+
+    if len(calls) > LONG_MESSAGE_MAX_CALLS:
+        preview = split_markdown(text, max_length - 40)[0]
+        file = discord.File(BytesIO(text.encode('utf-8')), filename="answer.md")
+        return await send(f"{preview}\n*(full answer attached)*", file=file)
+
+    for chunks in calls:
+        embeds = [discord.Embed(description=chunk, color=discord.Color.blue()) for chunk in chunks]
+        await send(embeds=embeds)
 
 async def send_long_message(interaction: discord.Interaction, text: str, prefix: str = "", max_length: int = 2000):
-    """Send a long message by splitting it into chunks if needed."""
-    # Remove the prefix length from max_length to account for it in each chunk
-    chunk_size = max_length - len(prefix) - 10  # Some buffer for formatting
-    
-    if len(text) <= chunk_size:
-        return await interaction.followup.send(f"{prefix}{text}")
-    
-    # Split the text into chunks
-    chunks = [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
-    
-    # Send the first chunk with the prefix
-    await interaction.followup.send(f"{prefix}{chunks[0]}")
-    
-    # Send remaining chunks
-    for chunk in chunks[1:]:
-        await interaction.followup.send(chunk)
+    """Send a long message as an interaction followup, packed into as few calls as possible."""
+    await send_markdown(interaction.followup.send, f"{prefix}{text}", max_length)
+
+class StreamingReply:
+    """Show streamed text by editing one message at a fixed cadence.
+
+    `send` posts a new message and returns it. Once the text passes
+    `max_length` the current message is finalized and the rest rolls over
+    into a new one.
+    """
+
+    def __init__(self, send, prefix: str = "", max_length: int = 2000, interval: float = STREAM_EDIT_INTERVAL):
+        self.send = send
+        self.max_length = max_length
+        self.interval = interval
+        self.text = prefix
+        self.message = None
+        self.shown = ""
+        self.last_edit = 0.0
+        self.received = False
 
-# GLM AI Integration
-async def get_glm_response(prompt: str):
+    async def feed(self, token: str):
+        """Add streamed text, editing the message if the interval has passed"""
+        self.received = True
+        self.text += token
+
+        # Roll over into a new message once the current one is full
+        while len(self.text) > self.max_length:
+            # Prefer a line or word break in the second half of the message
+            cut = self.text.rfind('\n', self.max_length // 2, self.max_length)
+            if cut == -1:
+                cut = self.text.rfind(' ', self.max_length // 2, self.max_length)
+            if cut == -1:
+                cut = self.max_length
+            await self._push(self.text[:cut])
+            self.text = self.text[cut:].lstrip()
+            self.message = None
+            self.shown = ""
+
+        if asyncio.get_running_loop().time() - self.last_edit >= self.interval:
+            await self._push(self.text)
+
+    async def finish(self, fallback: str = ""):
+        """Flush whatever is left once the stream has ended"""
+        if not self.received and fallback:
+            self.text += fallback
+        await self._push(self.text)
+
+    async def status(self, note: str):
+        """Show a temporary note until the first streamed text arrives"""
+        if not self.received:
+            await self._push(f"{self.text}{note}")
+            self.last_edit = 0.0
+
+    async def _push(self, content: str):
+        if not content.strip() or content == self.shown:
+            return
+        if self.message is None:
+            self.message = await self.send(content)
+        else:
+            await self.message.edit(content=content)
+        self.shown = content
+        self.last_edit = asyncio.get_running_loop().time()
+
+# GLM AI Integration (falls back to Cohere when COHERE_API_KEY is set)
+llm_client = default_router()
+response_cache = ResponseCache()
+inflight_prompts = SingleFlight()
+llm_scheduler = RequestScheduler()
+
+async def summarize_conversation(summary: str, turns: list) -> str:
+    """Fold older conversation turns into the running channel summary"""
+    transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+    return await llm_client.chat([
+        {
+            'role': 'user',
+            'content': (
+                "Update this conversation summary with the new messages. "
+                "Reply with the updated summary only, in a few sentences.\n\n"
+                f"Summary so far: {summary or 'None'}\n\nNew messages:\n{transcript}"
+            )
+        }
+    ])
+
+conversation_memory = ConversationMemory(summarize=summarize_conversation)
+
+def queued_message(wait: float) -> str:
+    """Tell a user their AI request is waiting in the queue"""
+    return f"⏳ The AI is busy, your question is queued (estimated wait: ~{max(1, round(wait))}s)"
+
+def glm_messages(prompt: str, channel_id: Optional[int] = None):
+    """Build the chat messages sent to the GLM model, including channel history"""
+    return conversation_memory.messages(channel_id, f"Please respond in English: {prompt}")
+
+async def generate_glm_response(messages: list, key: str, guild_id: Optional[int] = None,
+                                priority: bool = False, on_queued=None) -> str:
+    """Run one GLM generation and cache a successful answer"""
+    async with llm_scheduler.acquire(guild_id, priority, on_queued):
+        response = await llm_client.chat(messages)
+    if response:
+        response_cache.set(key, response)
+    return response
+
+async def generate_glm_stream(messages: list, key: str, guild_id: Optional[int] = None,
+                              priority: bool = False, on_queued=None):
+    """Stream one GLM generation and cache the answer once it completes"""
+    parts = []
+    async with llm_scheduler.acquire(guild_id, priority, on_queued):
+        async for token in llm_client.stream(messages):
+            parts.append(token)
+            yield token
+    if parts:
+        response_cache.set(key, "".join(parts))
+
+async def get_glm_response(prompt: str, channel_id: Optional[int] = None, guild_id: Optional[int] = None,
+                           priority: bool = False, on_queued=None):
     """Get response from GLM model via Ollama"""
+    messages = glm_messages(prompt, channel_id)
+    key = cache_key(prompt, llm_client.model, context=messages[:-1])
+    response = response_cache.get(key)
+
     try:
-        # Initialize Ollama client
-        client = ollama.Client(host='http://localhost:11434')
-        
-        # Generate response using GLM model
-        response = client.chat(
-            model='glm-4.6:cloud',  # Using the GLM model you have installed
-            messages=[
-                {
-                    'role': 'user',
-                    'content': f"Please respond in English: {prompt}"
-                }
-            ],
-            options={
-                'temperature': 0.7,
-                'max_tokens': 1000
-            }
-        )
-        
-        # Extract and return the response
-        if response and 'message' in response and 'content' in response['message']:
-            return response['message']['content']
-        else:
+        if response is None:
+            # Identical prompts already in flight share one generation
+            response = await inflight_prompts.run(
+                key, lambda: generate_glm_response(messages, key, guild_id, priority, on_queued)
+            )
+        if not response:
             return "No response from GLM model."
+        conversation_memory.record(channel_id, prompt, response, key)
+        return response
             
+    except QueueFullError as e:
+        return f"⚠️ {e}"
     except Exception as e:
         return f"Error connecting to GLM model: {str(e)}"
 
+async def stream_glm_response(prompt: str, reply: StreamingReply, channel_id: Optional[int] = None,
+                              guild_id: Optional[int] = None, priority: bool = False):
+    """Stream a GLM answer into a reply as tokens arrive"""
+    messages = glm_messages(prompt, channel_id)
+    key = cache_key(prompt, llm_client.model, context=messages[:-1])
+    cached = response_cache.get(key)
+    if cached is not None:
+        await reply.feed(cached)
+        await reply.finish()
+        conversation_memory.record(channel_id, prompt, cached, key)
+        return
+
+    async def on_queued(wait: float):
+        await reply.status(queued_message(wait))
+
+    try:
+        parts = []
+        async for token in inflight_prompts.stream(
+            key, lambda: generate_glm_stream(messages, key, guild_id, priority, on_queued)
+        ):
+            parts.append(token)
+            await reply.feed(token)
+        await reply.finish(fallback="No response from GLM model.")
+        if parts:
+            conversation_memory.record(channel_id, prompt, "".join(parts), key)
+    except QueueFullError as e:
+        await reply.finish(fallback=f"⚠️ {e}")
+    except Exception as e:
+        await reply.finish(fallback=f"Error connecting to GLM model: {str(e)}")
+
 # Music player functions
-def search_yt(query: str) -> str:
-    # Search for the video using yt-dlp
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'quiet': True,
-        'extract_flat': True,
-        'skip_download': True,
-        'default_search': 'ytsearch',
-        'noplaylist': True
-    }
-    
-    with YoutubeDL(ydl_opts) as ydl:
+def create_audio_source(stream: Optional[dict], cached_path: Optional[str] = None) -> discord.AudioSource:
+    """Pick the cheapest playback path for a resolved stream.
+
+    Locally cached tracks are read from disk. Opus streams are remuxed
+    straight into Discord's Opus packets, other codecs are encoded to Opus
+    by FFmpeg, and the Python-side PCM encoder is only used when
+    passthrough is turned off.
+    """
+    if cached_path:
+        return FFmpegOpusAudio(cached_path, codec='copy', options='-vn')
+    if not OPUS_PASSTHROUGH:
+        return FFmpegPCMAudio(stream['url'], **FFMPEG_OPTIONS)
+    codec = 'copy' if stream.get('acodec') == 'opus' else None
+    return FFmpegOpusAudio(stream['url'], codec=codec, **FFMPEG_OPTIONS)
+
+def prefetch_upcoming(guild_id: int):
+    """Start resolving the next tracks in a guild's queue"""
+    prefetch_queue(queues[guild_id], prefetchers.setdefault(guild_id, Prefetcher()))
+
+async def play_next(interaction: discord.Interaction) -> bool:
+    """Start the next track in the guild's queue and return whether one started"""
+    guild_id = interaction.guild.id
+    queue = queues.get(guild_id)
+    if queue is None:
+        # The guild's music state was released while the last track was stopping
+        return False
+
+    def start(stream: Optional[dict], cached_path: Optional[str]) -> bool:
+        voice = get(bot.voice_clients, guild=interaction.guild)
+        if not voice or not voice.is_connected() or voice.is_playing() or voice.is_paused():
+            return False
+        voice.play(create_audio_source(stream, cached_path), 
+                  after=lambda e: asyncio.run_coroutine_threadsafe(play_next(interaction), bot.loop))
+        return True
+
+    # Resolving a stream can take seconds, so a second /play must not start another track meanwhile
+    async with playback_locks.setdefault(guild_id, asyncio.Lock()):
+        return await play_next_track(queue, prefetchers.setdefault(guild_id, Prefetcher()), start)
+
+def release_guild(guild_id: int):
+    """Drop all music state held for a guild"""
+    queue = queues.pop(guild_id, None)
+    if queue is not None:
+        queue.clear()
+    for task in playlist_fills.pop(guild_id, ()):
+        task.cancel()
+    if guild_id in prefetchers:
+        prefetchers.pop(guild_id).clear()
+    playback_locks.pop(guild_id, None)
+    voice_lifecycle.forget(guild_id)
+
+class VoiceLifecycle:
+    """Leaves voice channels that are idle or empty and frees their state.
+
+    A guild counts as idle while nothing is playing, and as empty while no
+    one but bots is left in the channel. Each sweep disconnects guilds that
+    stayed idle or empty for longer than their timeout.
+    """
+
+    def __init__(self, idle_timeout: float = VOICE_IDLE_TIMEOUT, empty_timeout: float = VOICE_EMPTY_TIMEOUT,
+                 interval: float = VOICE_CHECK_INTERVAL):
+        self.idle_timeout = idle_timeout
+        self.empty_timeout = empty_timeout
+        self.interval = interval
+        self.idle_since = {}  # Guild ID -> time playback stopped
+        self.empty_since = {}  # Guild ID -> time the last listener left
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    def forget(self, guild_id: int):
+        self.idle_since.pop(guild_id, None)
+        self.empty_since.pop(guild_id, None)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"Error checking voice connections: {e}")
+
+    async def sweep(self):
+        now = asyncio.get_running_loop().time()
+        connected = set()
+        for voice in list(bot.voice_clients):
+            guild_id = voice.guild.id
+            connected.add(guild_id)
+            if not voice.is_connected():
+                continue
+
+            if voice.is_playing():
+                self.idle_since.pop(guild_id, None)
+            else:
+                self.idle_since.setdefault(guild_id, now)
+            if any(not member.bot for member in voice.channel.members):
+                self.empty_since.pop(guild_id, None)
+            else:
+                self.empty_since.setdefault(guild_id, now)
+
+            idle = now - self.idle_since.get(guild_id, now)
+            empty = now - self.empty_since.get(guild_id, now)
+            if idle >= self.idle_timeout or empty >= self.empty_timeout:
+                reason = "idle" if idle >= self.idle_timeout else "alone in the channel"
+                print(f"Leaving voice in guild {guild_id}: {reason}")
+                await self.leave(voice)
+
+        # State left behind by connections that dropped without a disconnect event
+        for guild_id in set(queues) | set(prefetchers) | set(playlist_fills) | set(self.idle_since):
+            if guild_id not in connected:
+                release_guild(guild_id)
+
+    async def leave(self, voice: discord.VoiceClient):
+        # Clear the queue first so stopping the current track does not start the next one
+        release_guild(voice.guild.id)
+        if voice.is_playing() or voice.is_paused():
+            voice.stop()
+        await voice.disconnect()
+
+voice_lifecycle = VoiceLifecycle()
+
+# Game registry
+announcements = set()  # Abandoned-game notices still being sent
+
+def announce_abandoned(game):
+    channel = bot.get_channel(game.channel_id)
+    if channel:
+        players = ", ".join(player.mention for player in game.players)
+        task = asyncio.create_task(channel.send(
+            f"⌛ The {type(game).__name__} game with {players} was closed after "
+            f"{int(GAME_IDLE_TIMEOUT // 60)} minutes of inactivity."
+        ))
+        announcements.add(task)
+        task.add_done_callback(announcements.discard)
+
+def forget_boards(game):
+    if board_renderer:
+        board_renderer.forget(board_surface(game))
+
+game_registry = GameRegistry(GAME_IDLE_TIMEOUT, GAME_SWEEP_INTERVAL,
+                             on_evict=announce_abandoned, on_remove=forget_boards)
+word_corpus = load_corpus()  # None when no corpus has been built, Hangman then uses its built-in words
+
+# Board images
+board_renderer = BoardRenderer() if RENDER_BOARDS else None
+
+def board_surface(game, *parts) -> str:
+    """Canvas name for one of a game's boards, every name for a game shares this prefix"""
+    return f"game-{game.game_id}-" + "-".join(str(part) for part in parts)
+
+def image_file(data: bytes, name: str) -> discord.File:
+    return discord.File(BytesIO(data), filename=f"{name}.{board_renderer.image_format}")
+
+async def tictactoe_board(game: TicTacToe) -> Tuple[str, List[discord.File]]:
+    """The board as an image attachment, or as emoji text when images are off or fail"""
+    if board_renderer:
         try:
-            info = ydl.extract_info(f"ytsearch:{query}", download=False)
-            if not info or 'entries' not in info or not info['entries']:
-                return None
-                
-            video_url = info['entries'][0]['url']
-            return video_url
+            data = await board_renderer.render_grid(board_surface(game, "ttt"), game.cells(), 3)
+            return "", [image_file(data, "board")]
         except Exception as e:
-            print(f"Error searching YouTube: {e}")
-            return None
+            print(f"Error rendering board: {e}")
+    return f"Board:\n{game.get_board_string()}\n", []
 
-async def play_next(interaction: discord.Interaction):
-    if queues[interaction.guild.id]:
-        url = queues[interaction.guild.id].pop(0)
-        current_song[interaction.guild.id] = url
-        
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'noplaylist': True,
-            'quiet': True
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            url2 = info['url']
-            voice = get(bot.voice_clients, guild=interaction.guild)
-            voice.play(FFmpegPCMAudio(url2, **FFMPEG_OPTIONS), 
-                      after=lambda e: asyncio.run_coroutine_threadsafe(play_next(interaction), bot.loop))
-            voice.is_playing()
-    else:
-        current_song[interaction.guild.id] = None
+async def battleship_boards(game: Battleship, player: discord.Member,
+                            show_fleet: bool = False) -> Tuple[str, List[discord.File]]:
+    """A player's tracking board, and optionally their fleet, as images or emoji text"""
+    views = [("tracking", "Your tracking board", False)] + ([("fleet", "Your fleet", True)] if show_fleet else [])
+    if board_renderer:
+        try:
+            files = []
+            for name, _, show_ships in views:
+                data = await board_renderer.render_grid(
+                    board_surface(game, "bs", player.id, name), game.board_cells(player, show_ships),
+                    game.board_size, labels=True, sea=True
+                )
+                files.append(image_file(data, name))
+            return "", files
+        except Exception as e:
+            print(f"Error rendering board: {e}")
+    text = "".join(f"{title}:\n{game.get_board_string(player, show_ships)}\n" for _, title, show_ships in views)
+    return text, []
+
+async def hangman_board(game: Hangman) -> Tuple[str, List[discord.File]]:
+    """The gallows and guessed word as an image, or as text"""
+    if board_renderer:
+        try:
+            data = await board_renderer.render_hangman(game.incorrect_guesses, game.get_display_word())
+            return f"Word: {game.get_display_word()}\n", [image_file(data, "hangman")]
+        except Exception as e:
+            print(f"Error rendering board: {e}")
+    return f"Word: {game.get_display_word()}\n{game.get_hangman_stage()}\n", []
 
 # Events
 @bot.event
 async def on_ready():
     print(f'Logged in as {bot.user.name} (ID: {bot.user.id})')
     print('------')
+    voice_lifecycle.start()
+    game_registry.start()
     try:
         synced = await bot.tree.sync()
         print(f"Synced {len(synced)} command(s)")
@@ -191,9 +565,18 @@ async def on_message(message):
         
         if content:
             # Bot was mentioned with a question
+            prefix = f"**{message.author.mention}** asked: {content}\n\n**Answer:** "
+            guild_id = message.guild.id if message.guild else None
+            priority = message.author.id in OWNER_IDS
             async with message.channel.typing():
-                response = await get_glm_response(content)
-                await message.reply(f"**{message.author.mention}** asked: {content}\n\n**Answer:** {response}")
+                if LLM_STREAMING:
+                    reply = StreamingReply(message.reply, prefix=prefix)
+                    await stream_glm_response(content, reply, message.channel.id, guild_id, priority)
+                else:
+                    async def on_queued(wait: float):
+                        await message.reply(queued_message(wait))
+                    response = await get_glm_response(content, message.channel.id, guild_id, priority, on_queued)
+                    await send_markdown(message.reply, f"{prefix}{response}")
         else:
             # Bot was mentioned without content
             await message.reply(f"Hello {message.author.mention}! How can I help you today?")
@@ -201,26 +584,43 @@ async def on_message(message):
     # Process commands normally
     await bot.process_commands(message)
 
+@bot.event
+async def on_voice_state_update(member, before, after):
+    # Free the guild's music state as soon as the bot is disconnected, by /stop or by a moderator
+    if member.id == bot.user.id and before.channel and not after.channel:
+        release_guild(member.guild.id)
+
 # AI Commands
 @bot.tree.command(name="ask", description="Ask the AI a question")
 @app_commands.describe(question="Your question for the AI")
 async def ask(interaction: discord.Interaction, question: str):
     """Ask the AI a question"""
     try:
-        response = await get_glm_response(question)
-        await send_long_message(interaction, f"**Question:** {question}\n\n**Answer:** {response}")
+        await interaction.response.defer()
+        priority = interaction.user.id in OWNER_IDS
+        if LLM_STREAMING:
+            reply = StreamingReply(interaction.followup.send, prefix=f"**Question:** {question}\n\n**Answer:** ")
+            await stream_glm_response(question, reply, interaction.channel_id, interaction.guild_id, priority)
+        else:
+            async def on_queued(wait: float):
+                await interaction.followup.send(queued_message(wait), ephemeral=True)
+            response = await get_glm_response(question, interaction.channel_id, interaction.guild_id, priority, on_queued)
+            await send_long_message(interaction, f"**Question:** {question}\n\n**Answer:** {response}")
     except Exception as e:
-        await interaction.response.send_message(f"An error occurred: {str(e)}", ephemeral=True)
+        await interaction.followup.send(f"An error occurred: {str(e)}", ephemeral=True)
 
 # Music Commands
 @bot.tree.command(name="play", description="Play music from YouTube")
-@app_commands.describe(query="Name or URL of the song to play")
+@app_commands.describe(query="Name or URL of the song or playlist to play")
 async def play(interaction: discord.Interaction, query: str):
     """Play music from YouTube"""
     if not interaction.user.voice:
         await interaction.response.send_message("You are not connected to a voice channel!", ephemeral=True)
         return
     
+    # Defer right away, the search can take longer than Discord's 3 second deadline
+    await interaction.response.defer()
+    
     voice_channel = interaction.user.voice.channel
     voice = get(bot.voice_clients, guild=interaction.guild)
     
@@ -229,23 +629,47 @@ async def play(interaction: discord.Interaction, query: str):
     else:
         voice = await voice_channel.connect()
     
-    url = search_yt(query)
-    if not url:
-        await interaction.response.send_message("Could not find the song.", ephemeral=True)
+    if is_playlist(query):
+        await play_playlist(interaction, voice, query)
         return
     
-    if interaction.guild.id not in queues:
-        queues[interaction.guild.id] = []
+    track = await find_track(query)
+    if not track:
+        await interaction.followup.send("Could not find the song.", ephemeral=True)
+        return
     
-    await interaction.response.defer()
+    queue = queues.setdefault(interaction.guild.id, MusicQueue())
+    queue.add(track)
+    if not voice.is_playing() and not voice.is_paused():
+        if await play_next(interaction):
+            await interaction.followup.send(f"Now playing: {queue.current.name}")
+            return
+        if not voice.is_playing() and not voice.is_paused():
+            await interaction.followup.send(f"Could not play {track.name}.", ephemeral=True)
+            return
+    prefetch_upcoming(interaction.guild.id)
+    await interaction.followup.send(f"Added to queue: {track.name} ({format_duration(track.duration)})")
+
+async def play_playlist(interaction: discord.Interaction, voice: discord.VoiceClient, url: str):
+    """Queue every track of a playlist at once and fill in their details in the background"""
+    tracks = await load_playlist(url)
+    if not tracks:
+        await interaction.followup.send("Could not load the playlist.", ephemeral=True)
+        return
+    
+    guild_id = interaction.guild.id
+    queues.setdefault(guild_id, MusicQueue()).extend(tracks)
+    
+    fills = playlist_fills.setdefault(guild_id, set())
+    task = asyncio.create_task(fill_tracks(tracks))
+    fills.add(task)
+    task.add_done_callback(fills.discard)
     
     if not voice.is_playing() and not voice.is_paused():
-        current_song[interaction.guild.id] = url
         await play_next(interaction)
-        await interaction.followup.send(f"Now playing: {url}")
     else:
-        queues[interaction.guild.id].append(url)
-        await interaction.followup.send(f"Added to queue: {url}")
+        prefetch_upcoming(guild_id)
+    await interaction.followup.send(f"📜 Added {len(tracks)} tracks from the playlist to the queue.")
 
 @bot.tree.command(name="skip", description="Skip the current song")
 async def skip(interaction: discord.Interaction):
@@ -262,105 +686,228 @@ async def stop(interaction: discord.Interaction):
     """Stop the music and clear the queue"""
     voice = get(bot.voice_clients, guild=interaction.guild)
     if voice and voice.is_connected():
-        if voice.is_playing() or voice.is_paused():
-            voice.stop()
-        if interaction.guild.id in queues:
-            queues[interaction.guild.id] = []
-        if interaction.guild.id in current_song:
-            current_song[interaction.guild.id] = None
-        await voice.disconnect()
+        await voice_lifecycle.leave(voice)
         await interaction.response.send_message("⏹️ Stopped the music and cleared the queue.")
     else:
         await interaction.response.send_message("I'm not connected to a voice channel!", ephemeral=True)
 
 @bot.tree.command(name="queue", description="Show the current music queue")
-async def show_queue(interaction: discord.Interaction):
+@app_commands.describe(page="Page of the queue to show")
+async def show_queue(interaction: discord.Interaction, page: int = 1):
     """Show the current music queue"""
-    if interaction.guild.id in queues and queues[interaction.guild.id]:
-        queue_list = "\n".join([f"{i+1}. {url}" for i, url in enumerate(queues[interaction.guild.id])])
-        await interaction.response.send_message(f"**Current Queue:**\n{queue_list}")
-    else:
+    queue = queues.get(interaction.guild.id)
+    if not queue:
         await interaction.response.send_message("The queue is empty.")
+        return
+    
+    pages = (len(queue) + QUEUE_PAGE_SIZE - 1) // QUEUE_PAGE_SIZE
+    page = max(1, min(page, pages))
+    queue_list = "\n".join(
+        f"{i}. {track.name} ({format_duration(track.duration)})"
+        for i, track in queue.page(page, QUEUE_PAGE_SIZE)
+    )
+    now_playing = f"**Now playing:** {queue.current.name}\n" if queue.current else ""
+    await interaction.response.send_message(
+        f"{now_playing}**Current Queue** (page {page}/{pages}, {len(queue)} tracks):\n{queue_list}"
+    )
+
+@bot.tree.command(name="shuffle", description="Shuffle the music queue")
+async def shuffle_queue(interaction: discord.Interaction):
+    """Shuffle the music queue"""
+    queue = queues.get(interaction.guild.id)
+    if not queue:
+        await interaction.response.send_message("The queue is empty.", ephemeral=True)
+        return
+    
+    queue.shuffle()
+    prefetch_upcoming(interaction.guild.id)
+    await interaction.response.send_message(f"🔀 Shuffled {len(queue)} tracks.")
+
+@bot.tree.command(name="qmove", description="Move a track to another position in the queue")
+@app_commands.describe(source="Position of the track to move", target="New position for the track")
+async def move_track(interaction: discord.Interaction, source: int, target: int):
+    """Move a track within the music queue"""
+    queue = queues.get(interaction.guild.id)
+    if not queue or not 1 <= source <= len(queue) or not 1 <= target <= len(queue):
+        await interaction.response.send_message("Invalid queue position!", ephemeral=True)
+        return
+    
+    track = queue.move(source - 1, target - 1)  # Convert to 0-based index
+    prefetch_upcoming(interaction.guild.id)
+    await interaction.response.send_message(f"Moved **{track.name}** to position {target}.")
+
+@bot.tree.command(name="qremove", description="Remove one or more tracks from the queue")
+@app_commands.describe(start="First position to remove", end="Last position to remove (default: same as start)")
+async def remove_tracks(interaction: discord.Interaction, start: int, end: Optional[int] = None):
+    """Remove a range of tracks from the music queue"""
+    queue = queues.get(interaction.guild.id)
+    end = end or start
+    if not queue or start < 1 or end < start:
+        await interaction.response.send_message("Invalid queue position!", ephemeral=True)
+        return
+    
+    removed = queue.remove_range(start - 1, end)  # Convert to 0-based, end-exclusive range
+    prefetch_upcoming(interaction.guild.id)
+    await interaction.response.send_message(f"🗑️ Removed {removed} track(s) from the queue.")
 
 # Game Commands
-@bot.tree.command(name="tictactoe", description="Start a Tic-Tac-Toe game with another user")
-@app_commands.describe(opponent="The user to play against")
-async def tictactoe(interaction: discord.Interaction, opponent: discord.Member):
+@bot.tree.command(name="tictactoe", description="Start a Tic-Tac-Toe game with another user or the bot")
+@app_commands.describe(opponent="The user to play against (leave empty to play against the bot)")
+async def tictactoe(interaction: discord.Interaction, opponent: Optional[discord.Member] = None):
     """Start a Tic-Tac-Toe game"""
     if interaction.user == opponent:
         await interaction.response.send_message("You can't play against yourself!", ephemeral=True)
         return
-        
-    game = TicTacToe(interaction.user, opponent)
-    active_games[interaction.user.id] = game
-    active_games[opponent.id] = game
     
+    solo = opponent is None or opponent.id == bot.user.id
+    if not solo and opponent.bot:
+        await interaction.response.send_message("You can't challenge other bots!", ephemeral=True)
+        return
+    
+    busy = game_registry.busy_player([interaction.user] if solo else [interaction.user, opponent])
+    if busy:
+        await interaction.response.send_message(f"{busy.mention} is already in a game!", ephemeral=True)
+        return
+    
+    if solo:
+        opponent = interaction.guild.me if interaction.guild else bot.user
+    game = game_registry.add(TicTacToe(interaction.user, opponent, bot_opponent=solo), interaction.channel_id)
+    
+    board, files = await tictactoe_board(game)
     await interaction.response.send_message(
-        f"🎮 {interaction.user.mention} has challenged {opponent.mention} to Tic-Tac-Toe!\n"
-        f"Board:\n{game.get_board_string()}"
+        f"🎮 {interaction.user.mention} has challenged {opponent.mention} to Tic-Tac-Toe!\n{board}",
+        files=files
     )
 
 @bot.tree.command(name="hangman", description="Start a game of Hangman")
-async def hangman(interaction: discord.Interaction):
+@app_commands.describe(
+    difficulty="How hard the word should be",
+    length="Number of letters in the word",
+    category="Word list to pick from"
+)
+@app_commands.choices(difficulty=[app_commands.Choice(name=level.title(), value=level) for level in DIFFICULTIES])
+async def hangman(interaction: discord.Interaction, difficulty: Optional[str] = None,
+                  length: Optional[int] = None, category: Optional[str] = None):
     """Start a Hangman game"""
-    if interaction.user.id in active_games:
+    if game_registry.busy_player([interaction.user]):
         await interaction.response.send_message("You're already in a game!", ephemeral=True)
         return
+    
+    if length is not None and length < 1:
+        await interaction.response.send_message("The word needs at least one letter!", ephemeral=True)
+        return
+    
+    word = None
+    if word_corpus:
+        if category and category not in word_corpus.categories:
+            await interaction.response.send_message(f"Unknown category: {category}", ephemeral=True)
+            return
+        word = word_corpus.random_word(category, difficulty, length)
+        if word is None:
+            await interaction.response.send_message("No words match those options!", ephemeral=True)
+            return
+    elif difficulty or length or category:
+        await interaction.response.send_message("Word options are not available on this bot.", ephemeral=True)
+        return
         
-    game = Hangman(interaction.user)
-    active_games[interaction.user.id] = game
-    await interaction.response.send_message(
-        f"🎮 Hangman game started! Word: {game.get_display_word()}\n"
-        f"{game.get_hangman_stage()}"
-    )
+    game = game_registry.add(Hangman(interaction.user, word), interaction.channel_id)
+    board, files = await hangman_board(game)
+    await interaction.response.send_message(f"🎮 Hangman game started! {board}", files=files)
 
-@bot.tree.command(name="battleship", description="Start a Battleship game with another user")
-@app_commands.describe(opponent="The user to play against")
-async def battleship(interaction: discord.Interaction, opponent: discord.Member):
+@hangman.autocomplete('category')
+async def hangman_category_autocomplete(interaction: discord.Interaction, current: str):
+    categories = word_corpus.categories if word_corpus else []
+    return [app_commands.Choice(name=category, value=category)
+            for category in categories if current.lower() in category.lower()][:25]
+
+@hangman.autocomplete('length')
+async def hangman_length_autocomplete(interaction: discord.Interaction, current: str):
+    """Word lengths that have words for the category and difficulty chosen so far"""
+    if not word_corpus:
+        return []
+    category = getattr(interaction.namespace, 'category', None)
+    difficulty = getattr(interaction.namespace, 'difficulty', None)
+    choices = []
+    for length in word_corpus.lengths:
+        words = word_corpus.count_matching(category, difficulty, length)
+        if words and str(length).startswith(str(current or '')):
+            choices.append(app_commands.Choice(name=f"{length} letters ({words} words)", value=length))
+    return choices[:25]
+
+@bot.tree.command(name="battleship", description="Start a Battleship game with another user or the bot")
+@app_commands.describe(
+    opponent="The user to play against (leave empty to play against the bot)",
+    size=f"Board size ({Battleship.MIN_BOARD_SIZE}-{Battleship.MAX_BOARD_SIZE}, default {Battleship.BOARD_SIZE})",
+    ships="Comma-separated ship sizes (default 5,4,3,3,2)"
+)
+async def battleship(interaction: discord.Interaction, opponent: Optional[discord.Member] = None,
+                     size: Optional[int] = None, ships: Optional[str] = None):
     """Start a Battleship game"""
     if interaction.user == opponent:
         await interaction.response.send_message("You can't play against yourself!", ephemeral=True)
         return
-        
-    game = Battleship(interaction.user, opponent)
-    active_games[interaction.user.id] = game
-    active_games[opponent.id] = game
+    
+    solo = opponent is None or opponent.id == bot.user.id
+    if not solo and opponent.bot:
+        await interaction.response.send_message("You can't challenge other bots!", ephemeral=True)
+        return
+    
+    board_size = size or Battleship.BOARD_SIZE
+    try:
+        fleet = [int(ship) for ship in ships.split(',')] if ships else Battleship.SHIPS
+    except ValueError:
+        await interaction.response.send_message("Ships must be a comma-separated list of sizes, like 5,4,3.", ephemeral=True)
+        return
+    problem = Battleship.check_setup(board_size, fleet)
+    if problem:
+        await interaction.response.send_message(problem, ephemeral=True)
+        return
+    
+    busy = game_registry.busy_player([interaction.user] if solo else [interaction.user, opponent])
+    if busy:
+        await interaction.response.send_message(f"{busy.mention} is already in a game!", ephemeral=True)
+        return
+    
+    if solo:
+        opponent = interaction.guild.me if interaction.guild else bot.user
+    try:
+        game = Battleship(interaction.user, opponent, board_size, fleet, bot_opponent=solo)
+    except ValueError as e:
+        await interaction.response.send_message(str(e), ephemeral=True)
+        return
+    game_registry.add(game, interaction.channel_id)
     
     await interaction.response.send_message(
-        f"🚢 {interaction.user.mention} has challenged {opponent.mention} to Battleship!\n"
-        "Setting up boards..."
+        f"🚢 {interaction.user.mention} has challenged {opponent.mention} to Battleship "
+        f"on a {board_size}x{board_size} board with ships {', '.join(map(str, fleet))}!\n"
+        "Game started! Use `/shoot x y` to make a move."
     )
-    await asyncio.sleep(2)
-    await interaction.followup.send("Game started! Use `/shoot x y` to make a move.")
 
 # Game Move Commands
 @bot.tree.command(name="move", description="Make a move in Tic-Tac-Toe")
 @app_commands.describe(position="Position to place your mark (1-9)")
 async def move(interaction: discord.Interaction, position: int):
     """Make a move in Tic-Tac-Toe"""
-    if interaction.user.id not in active_games:
+    game = game_registry.get(interaction.user.id)
+    if game is None:
         await interaction.response.send_message("You're not in a game!", ephemeral=True)
         return
         
-    game = active_games[interaction.user.id]
     if not isinstance(game, TicTacToe):
         await interaction.response.send_message("This command is for Tic-Tac-Toe!", ephemeral=True)
         return
         
     if game.make_move(interaction.user, position - 1):  # Convert to 0-based index
+        game.bot_move()
+        board, files = await tictactoe_board(game)
         if game.winner:
-            await interaction.response.send_message(
-                f"Board:\n{game.get_board_string()}\n"
-                f"🎉 {game.winner.mention} wins!"
-            )
-            del active_games[game.player1.id]
-            if game.player2:
-                del active_games[game.player2.id]
+            await interaction.response.send_message(f"{board}🎉 {game.winner.mention} wins!", files=files)
+            game_registry.remove(game)
+        elif game.finished:
+            await interaction.response.send_message(f"{board}🤝 It's a draw!", files=files)
+            game_registry.remove(game)
         else:
-            await interaction.response.send_message(
-                f"Board:\n{game.get_board_string()}\n"
-                f"{game.current_player.mention}'s turn!"
-            )
+            await interaction.response.send_message(f"{board}{game.current_player.mention}'s turn!", files=files)
     else:
         await interaction.response.send_message("Invalid move!", ephemeral=True)
 
@@ -368,69 +915,81 @@ async def move(interaction: discord.Interaction, position: int):
 @app_commands.describe(letter="The letter to guess")
 async def guess(interaction: discord.Interaction, letter: str):
     """Guess a letter in Hangman"""
-    if interaction.user.id not in active_games:
+    game = game_registry.get(interaction.user.id)
+    if game is None:
         await interaction.response.send_message("You're not in a game!", ephemeral=True)
         return
         
-    game = active_games[interaction.user.id]
     if not isinstance(game, Hangman):
         await interaction.response.send_message("This command is for Hangman!", ephemeral=True)
         return
         
-    result = game.guess(letter.upper())
-    response = f"Word: {game.get_display_word()}\n{game.get_hangman_stage()}"
+    valid, game_continues = game.guess(letter.upper())
+    if not valid:
+        await interaction.response.send_message("Guess a single letter you haven't tried yet!", ephemeral=True)
+        return
+    response, files = await hangman_board(game)
     
-    if game.winner:
-        if game.winner == "won":
-            response += f"\n🎉 You won! The word was: {game.word}"
+    if not game_continues:
+        if game.winner:
+            response += f"🎉 You won! The word was: {game.word}"
         else:
-            response += f"\n😢 Game over! The word was: {game.word}"
-        del active_games[interaction.user.id]
+            response += f"😢 Game over! The word was: {game.word}"
+        game_registry.remove(game)
     
-    await interaction.response.send_message(response)
+    await interaction.response.send_message(response, files=files)
 
 @bot.tree.command(name="shoot", description="Shoot at coordinates in Battleship")
-@app_commands.describe(x="X coordinate (1-10)", y="Y coordinate (1-10)")
+@app_commands.describe(x="Row, starting at 1", y="Column, starting at 1")
 async def shoot(interaction: discord.Interaction, x: int, y: int):
     """Shoot at coordinates in Battleship"""
-    if interaction.user.id not in active_games:
+    game = game_registry.get(interaction.user.id)
+    if game is None:
         await interaction.response.send_message("You're not in a game!", ephemeral=True)
         return
         
-    game = active_games[interaction.user.id]
     if not isinstance(game, Battleship):
         await interaction.response.send_message("This command is for Battleship!", ephemeral=True)
         return
         
-    if game.current_player != interaction.user:
-        await interaction.response.send_message("It's not your turn!", ephemeral=True)
+    valid, message, game_over = game.make_move(interaction.user, x - 1, y - 1)  # Convert to 0-based index
+    if not valid:
+        await interaction.response.send_message(message, ephemeral=True)
         return
-        
-    result = game.make_move(interaction.user, x - 1, y - 1)  # Convert to 0-based index
-    response = ""
     
-    if result == "hit":
-        response = "💥 Direct hit!"
-    elif result == "miss":
-        response = "💦 Missed!"
-    elif result == "already_shot":
-        response = "You've already shot there!"
-    elif result == "sunk":
-        response = "🔥 You sunk a ship!"
-    elif result == "win":
-        response = f"🏆 {interaction.user.mention} has won the game!"
-        del active_games[game.player1.id]
-        del active_games[game.player2.id]
+    response = f"{message}\n"
+    shots = []
+    if game_over:
+        response += f"🏆 {interaction.user.mention} has won the game!\n"
+        game_registry.remove(game)
+    elif game.ai is not None:
+        # Solo game: the bot answers right away, firing again after each hit
+        shots = game.bot_turn()
+        response += "".join(f"{shot}\n" for shot in shots)
+        if game.winner:
+            response += "🤖 The bot has sunk your whole fleet and won the game!\n"
+            game_registry.remove(game)
+        else:
+            response += "🎯 Your turn!\n"
     else:
-        response = "Invalid coordinates!"
-    
-    response += f"\nYour tracking board:\n{game.get_board_string(interaction.user)}"
+        response += f"🎯 {game.current_player.mention}'s turn!\n"
     
-    if result != "win":
-        game.current_player = game.player2 if game.current_player == game.player1 else game.player1
-        response += f"\n🎯 {game.current_player.mention}'s turn!"
+    boards, files = await battleship_boards(game, interaction.user, show_fleet=bool(shots))
+    await interaction.response.send_message(response + boards, files=files)
+
+@bot.tree.command(name="games", description="List the games running in this channel")
+async def list_games(interaction: discord.Interaction):
+    """List the games running in this channel"""
+    games = game_registry.in_channel(interaction.channel_id)
+    if not games:
+        await interaction.response.send_message("No games are running in this channel.", ephemeral=True)
+        return
     
-    await interaction.response.send_message(response)
+    lines = [
+        f"**{type(game).__name__}** - {' vs '.join(player.display_name for player in game.players)}"
+        for game in games
+    ]
+    await interaction.response.send_message("🎮 Games in this channel:\n" + "\n".join(lines))
 
 # Utility Commands
 @bot.tree.command(name="help", description="Show all available commands")
@@ -445,12 +1004,13 @@ async def help_command(interaction: discord.Interaction):
     help_embed.add_field(
         name="🎮 Games",
         value=(
-            "`/tictactoe @user` - Start a Tic-Tac-Toe game\n"
-            "`/hangman` - Start a Hangman game\n"
-            "`/battleship @user` - Start a Battleship game\n"
+            "`/tictactoe [@user]` - Start a Tic-Tac-Toe game (against the bot without a user)\n"
+            "`/hangman [difficulty] [length] [category]` - Start a Hangman game\n"
+            "`/battleship [@user] [size] [ships]` - Start a Battleship game (against the bot without a user)\n"
             "`/move 1-9` - Make a move in Tic-Tac-Toe\n"
             "`/guess A` - Guess a letter in Hangman\n"
-            "`/shoot x y` - Shoot at coordinates in Battleship"
+            "`/shoot x y` - Shoot at coordinates in Battleship\n"
+            "`/games` - List the games running in this channel"
         ),
         inline=False
     )
@@ -458,10 +1018,13 @@ async def help_command(interaction: discord.Interaction):
     help_embed.add_field(
         name="🎵 Music",
         value=(
-            "`/play <song>` - Play a song from YouTube\n"
+            "`/play <song>` - Play a song or playlist from YouTube\n"
             "`/skip` - Skip the current song\n"
             "`/stop` - Stop the music and clear the queue\n"
-            "`/queue` - Show the current music queue"
+            "`/queue [page]` - Show the current music queue\n"
+            "`/shuffle` - Shuffle the queue\n"
+            "`/qmove from to` - Move a track in the queue\n"
+            "`/qremove start [end]` - Remove tracks from the queue"
         ),
         inline=False
     )
@@ -1032,7 +1595,8 @@ async def on_disconnect():
 from threading import Thread
 
 async def start_flask():
-    from server import app, socketio
+    from server import asgi_app
+    import uvicorn
     port = int(os.getenv('PORT', 10000))
     
     # Create a simple HTTP server for health checks
@@ -1056,9 +1620,9 @@ async def start_flask():
     health_thread = threading.Thread(target=run_health_check, daemon=True)
     health_thread.start()
     
-    # Start the Flask server
-    print(f"Starting Flask server on port {port}...")
-    socketio.run(app, host='0.0.0.0', port=port, debug=False, use_reloader=False, allow_unsafe_werkzeug=True)
+    # Start the web server (Socket.IO and the async chat API, with the Flask app mounted)
+    print(f"Starting web server on port {port}...")
+    await uvicorn.Server(uvicorn.Config(asgi_app, host='0.0.0.0', port=port)).serve()
 
 async def main():
     # Start the Flask server in a separate thread
@@ -1085,6 +1649,8 @@ async def main():
         print(f"Bot error: {e}")
     finally:
         # Clean up resources
+        await llm_client.close()
+        response_cache.save()
         if 'browser' in globals() and browser:
             await browser.close()
         if 'playwright' in globals() and playwright:
@@ -1,7 +1,12 @@
 import discord
+import time
 import random
 import asyncio
-from typing import Dict, Tuple, Optional, List
+import numpy as np
+from collections import Counter
+from functools import lru_cache
+from itertools import count
+from typing import Dict, Tuple, Optional, List, Set, Callable
 
 # Game states
 class GameState:
@@ -13,50 +18,227 @@ class GameState:
         self.board = None
         self.started = False
         self.message = None
+        self.bot_player = None  # Set when the bot itself plays, it is never registered as a player
+        self.game_id = None  # Set by GameRegistry.add
+        self.channel_id = None
+        self.last_active = time.monotonic()
+
+    @property
+    def players(self) -> List[discord.Member]:
+        return [player for player in (self.player1, self.player2)
+                if player is not None and player != self.bot_player]
+
+class GameRegistry:
+    """Active games indexed by game ID, player and channel.
+
+    Idle games are evicted with a timing wheel. Each game is filed in the
+    slot for the tick at which it would expire, and every tick only that
+    slot is checked. A game that saw activity since it was filed is moved
+    to its new slot instead of being evicted, so a move costs one
+    timestamp update however many games are running.
+    """
+
+    def __init__(self, idle_timeout: float = 600, tick: float = 30,
+                 on_evict: Optional[Callable[[GameState], None]] = None,
+                 on_remove: Optional[Callable[[GameState], None]] = None):
+        self.idle_timeout = idle_timeout
+        self.tick = tick
+        self.on_evict = on_evict
+        self.on_remove = on_remove  # Called for every game that ends, finished or evicted
+        self.games: Dict[int, GameState] = {}
+        self.by_player: Dict[int, int] = {}  # Player ID -> game ID
+        self.by_channel: Dict[int, Set[int]] = {}  # Channel ID -> game IDs
+        self.wheel: List[Set[int]] = [set() for _ in range(int(idle_timeout // tick) + 2)]
+        self.current_tick = self._tick_of(time.monotonic())
+        self.ids = count(1)
+        self.task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self.games)
+
+    def _tick_of(self, timestamp: float) -> int:
+        return int(timestamp // self.tick)
+
+    def _schedule(self, game: GameState):
+        due = self._tick_of(game.last_active + self.idle_timeout)
+        self.wheel[max(due, self.current_tick + 1) % len(self.wheel)].add(game.game_id)
+
+    def busy_player(self, players: List[discord.Member]) -> Optional[discord.Member]:
+        """Return the first of `players` who is already in a game"""
+        return next((player for player in players if player.id in self.by_player), None)
+
+    def add(self, game: GameState, channel_id: int) -> GameState:
+        game.game_id = next(self.ids)
+        game.channel_id = channel_id
+        game.last_active = time.monotonic()
+        self.games[game.game_id] = game
+        for player in game.players:
+            self.by_player[player.id] = game.game_id
+        self.by_channel.setdefault(channel_id, set()).add(game.game_id)
+        self._schedule(game)
+        return game
+
+    def get(self, player_id: int) -> Optional[GameState]:
+        """Look up a player's game and count the lookup as activity"""
+        game = self.games.get(self.by_player.get(player_id))
+        if game is not None:
+            game.last_active = time.monotonic()
+        return game
+
+    def in_channel(self, channel_id: int) -> List[GameState]:
+        return [self.games[game_id] for game_id in sorted(self.by_channel.get(channel_id, ()))]
+
+    def remove(self, game: GameState):
+        # Wheel entries are left behind and skipped when their slot comes up
+        if self.games.pop(game.game_id, None) is None:
+            return
+        for player in game.players:
+            if self.by_player.get(player.id) == game.game_id:
+                del self.by_player[player.id]
+        channel_games = self.by_channel.get(game.channel_id)
+        if channel_games is not None:
+            channel_games.discard(game.game_id)
+            if not channel_games:
+                del self.by_channel[game.channel_id]
+        if self.on_remove:
+            self.on_remove(game)
+
+    def sweep(self, now: Optional[float] = None) -> List[GameState]:
+        """Advance the wheel to `now` and evict games that have been idle too long"""
+        now_tick = self._tick_of(time.monotonic() if now is None else now)
+        evicted = []
+        # After a long pause every slot is due, so one turn of the wheel is enough
+        first = max(self.current_tick + 1, now_tick - len(self.wheel) + 1)
+        self.current_tick = now_tick
+        for tick in range(first, now_tick + 1):
+            slot = self.wheel[tick % len(self.wheel)]
+            due_ids = list(slot)
+            slot.clear()
+            for game_id in due_ids:
+                game = self.games.get(game_id)
+                if game is None:
+                    continue
+                if self._tick_of(game.last_active + self.idle_timeout) <= now_tick:
+                    self.remove(game)
+                    evicted.append(game)
+                else:
+                    self._schedule(game)
+        if self.on_evict:
+            for game in evicted:
+                self.on_evict(game)
+        return evicted
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error sweeping idle games: {e}")
+
+# Tic-Tac-Toe bitboards: bit i is set when a player holds cell i (0-8, row by row)
+TTT_FULL = 0b111111111
+TTT_WIN_MASKS = (
+    0b000000111, 0b000111000, 0b111000000,  # rows
+    0b001001001, 0b010010010, 0b100100100,  # columns
+    0b100010001, 0b001010100  # diagonals
+)
+# Lookup of every 9-bit board: does it contain a complete line?
+TTT_WINNING = tuple(any(bits & mask == mask for mask in TTT_WIN_MASKS) for bits in range(1 << 9))
+
+# Transposition table: (mover bits, other bits) -> (score, best moves) for every reachable position.
+# Filled on first use; a win scores higher the earlier it comes.
+_ttt_table: Dict[Tuple[int, int], Tuple[int, Tuple[int, ...]]] = {}
+
+def _ttt_solve(mover: int, other: int) -> int:
+    key = (mover, other)
+    if key in _ttt_table:
+        return _ttt_table[key][0]
+
+    empty = ~(mover | other) & TTT_FULL
+    best_score, best_moves = -10, []
+    for position in range(9):
+        bit = 1 << position
+        if not empty & bit:
+            continue
+        board = mover | bit
+        if TTT_WINNING[board]:
+            score = bin(empty).count('1')
+        elif empty == bit:
+            score = 0  # Last cell filled without a winner
+        else:
+            score = -_ttt_solve(other, board)
+        if score > best_score:
+            best_score, best_moves = score, [position]
+        elif score == best_score:
+            best_moves.append(position)
+
+    _ttt_table[key] = (best_score, tuple(best_moves))
+    return best_score
+
+def ttt_best_moves(mover: int, other: int) -> Tuple[int, ...]:
+    """Optimal moves for the player to move, solving the whole game tree on the first call"""
+    if not _ttt_table:
+        _ttt_solve(0, 0)
+    return _ttt_table[(mover, other)][1]
 
 class TicTacToe(GameState):
-    def __init__(self, player1: discord.Member, player2: discord.Member):
+    def __init__(self, player1: discord.Member, player2: discord.Member, bot_opponent: bool = False):
         super().__init__(player1, player2)
-        self.board = ["⬜"] * 9
+        self.bits = {player1: 0, player2: 0}
         self.started = True
+        self.finished = False
         self.x_player = player1
         self.o_player = player2
+        if bot_opponent:
+            self.bot_player = player2
+
+    def cells(self) -> List[str]:
+        x_bits, o_bits = self.bits[self.x_player], self.bits[self.o_player]
+        return ["❌" if x_bits >> i & 1 else "⭕" if o_bits >> i & 1 else "⬜" for i in range(9)]
 
     def make_move(self, player: discord.Member, position: int) -> bool:
-        if player != self.current_player or position < 0 or position >= 9 or self.board[position] != "⬜":
+        if (self.finished or player != self.current_player or position < 0 or position >= 9
+                or (self.bits[self.x_player] | self.bits[self.o_player]) >> position & 1):
             return False
             
-        self.board[position] = "❌" if player == self.x_player else "⭕"
+        self.bits[player] |= 1 << position
         
         # Check for winner
         if self.check_winner():
             self.winner = player
+            self.finished = True
             return True
             
         # Check for draw
-        if "⬜" not in self.board:
+        if self.bits[self.x_player] | self.bits[self.o_player] == TTT_FULL:
+            self.finished = True
             return True
             
         self.current_player = self.o_player if player == self.x_player else self.x_player
         return True
     
     def check_winner(self) -> bool:
-        # Check rows, columns and diagonals
-        lines = [
-            [0, 1, 2], [3, 4, 5], [6, 7, 8],  # rows
-            [0, 3, 6], [1, 4, 7], [2, 5, 8],  # columns
-            [0, 4, 8], [2, 4, 6]  # diagonals
-        ]
-        
-        for line in lines:
-            if (self.board[line[0]] == self.board[line[1]] == self.board[line[2]] != "⬜"):
-                return True
-        return False
+        return TTT_WINNING[self.bits[self.x_player]] or TTT_WINNING[self.bits[self.o_player]]
+
+    def bot_move(self) -> Optional[int]:
+        """Play a perfect move for the bot opponent if it is the bot's turn"""
+        if self.finished or self.bot_player is None or self.current_player != self.bot_player:
+            return None
+        opponent = self.x_player if self.bot_player == self.o_player else self.o_player
+        position = random.choice(ttt_best_moves(self.bits[self.bot_player], self.bits[opponent]))
+        self.make_move(self.bot_player, position)
+        return position
     
     def get_board_string(self) -> str:
+        board = self.cells()
         board_str = ""
         for i in range(0, 9, 3):
-            board_str += "".join(self.board[i:i+3]) + "\n"
+            board_str += "".join(board[i:i+3]) + "\n"
         return board_str
 
 class Hangman(GameState):
@@ -128,9 +310,9 @@ class Hangman(GameState):
     
     WORDS = ["PYTHON", "JAVASCRIPT", "PROGRAMMING", "DEVELOPER", "DISCORD", "BOT", "HANGMAN", "COMPUTER"]
     
-    def __init__(self, player: discord.Member):
+    def __init__(self, player: discord.Member, word: Optional[str] = None):
         super().__init__(player)
-        self.word = random.choice(self.WORDS).upper()
+        self.word = (word or random.choice(self.WORDS)).upper()
         self.guessed_letters = set()
         self.incorrect_guesses = 0
         self.max_attempts = len(self.HANGMAN_STAGES) - 1
@@ -194,51 +376,85 @@ class GuessTheNumber(GameState):
             self.winner = self.player1
             return True, f"🎉 Correct! You guessed the number in {self.attempts} attempts!"
 
+@lru_cache(maxsize=None)
+def ship_placements(board_size: int, size: int) -> Tuple[Tuple[int, Tuple[int, ...]], ...]:
+    """Every legal position of a ship as (bitmask, cell indexes), cells numbered x * board_size + y"""
+    placements = []
+    for x in range(board_size):
+        for y in range(board_size - size + 1):
+            horizontal = tuple(x * board_size + y + i for i in range(size))
+            vertical = tuple((y + i) * board_size + x for i in range(size))
+            for cells in (horizontal, vertical) if size > 1 else (horizontal,):
+                placements.append((sum(1 << cell for cell in cells), cells))
+    return tuple(placements)
+
+def place_fleet(board_size: int, ships: List[int], attempts: int = 100) -> List[Tuple[int, ...]]:
+    """Randomly place a fleet without overlaps, returning each ship's cells in fleet order.
+
+    Ships are placed largest first, each drawn uniformly from the precomputed
+    placements that do not overlap the ones already chosen.
+    """
+    order = sorted(range(len(ships)), key=lambda i: -ships[i])
+    for _ in range(attempts):
+        occupied = 0
+        fleet = [None] * len(ships)
+        for i in order:
+            free = [placement for placement in ship_placements(board_size, ships[i]) if not placement[0] & occupied]
+            if not free:
+                break
+            mask, fleet[i] = random.choice(free)
+            occupied |= mask
+        else:
+            return fleet
+    raise ValueError(f"Could not fit ships {ships} on a {board_size}x{board_size} board")
+
 class Battleship(GameState):
     BOARD_SIZE = 8
     SHIPS = [5, 4, 3, 3, 2]  # Ship sizes
+    MIN_BOARD_SIZE, MAX_BOARD_SIZE = 5, 10  # Larger boards do not fit in a Discord message
     
-    def __init__(self, player1: discord.Member, player2: discord.Member):
+    # Shot marks on a player's tracking grid
+    UNKNOWN, MISS, HIT, SUNK = 0, 1, 2, 3
+    
+    def __init__(self, player1: discord.Member, player2: discord.Member,
+                 board_size: Optional[int] = None, ships: Optional[List[int]] = None, bot_opponent: bool = False):
         super().__init__(player1, player2)
-        self.boards = {
-            player1: self.create_board(),
-            player2: self.create_board()
-        }
-        self.tracking_boards = {
-            player1: [['🌊'] * self.BOARD_SIZE for _ in range(self.BOARD_SIZE)],
-            player2: [['🌊'] * self.BOARD_SIZE for _ in range(self.BOARD_SIZE)]
-        }
-        self.ships = {
-            player1: self.place_ships(self.boards[player1]),
-            player2: self.place_ships(self.boards[player2])
-        }
+        self.board_size = board_size or self.BOARD_SIZE
+        self.fleet = list(ships or self.SHIPS)
+        self.ai = None
+        if bot_opponent:
+            self.bot_player = player2
+            self.ai = BattleshipAI(self.board_size)
+        # Each grid is a flat bytearray indexed by x * board_size + y, holding 0 for water or ship index + 1
+        self.grids = {}
+        self.ship_cells = {}  # Player -> list of cell indexes for each ship
+        self.ship_remaining = {}  # Player -> cells not yet hit for each ship
+        self.remaining = {}  # Player -> cells not yet hit across the whole fleet
+        self.shots = {}  # Player -> marks for the shots they fired at their opponent
+        for player in (player1, player2):
+            self.grids[player] = bytearray(self.board_size * self.board_size)
+            self.ship_cells[player] = self.place_ships(self.grids[player])
+            self.ship_remaining[player] = [len(cells) for cells in self.ship_cells[player]]
+            self.remaining[player] = sum(self.ship_remaining[player])
+            self.shots[player] = bytearray(self.board_size * self.board_size)
         self.started = True
     
-    def create_board(self) -> List[List[str]]:
-        return [['🌊'] * self.BOARD_SIZE for _ in range(self.BOARD_SIZE)]
+    @classmethod
+    def check_setup(cls, board_size: int, ships: List[int]) -> Optional[str]:
+        """Return why a board size and fleet cannot be played, or None if they can"""
+        if not cls.MIN_BOARD_SIZE <= board_size <= cls.MAX_BOARD_SIZE:
+            return f"The board size must be between {cls.MIN_BOARD_SIZE} and {cls.MAX_BOARD_SIZE}."
+        if not ships or any(size < 1 or size > board_size for size in ships):
+            return f"Ship sizes must be between 1 and {board_size}."
+        if sum(ships) > board_size * board_size // 2:
+            return "The fleet can cover at most half of the board."
+        return None
     
-    def place_ships(self, board: List[List[str]]) -> Dict[Tuple[int, int], int]:
-        ships = {}
-        for size in self.SHIPS:
-            placed = False
-            while not placed:
-                orientation = random.choice(['horizontal', 'vertical'])
-                if orientation == 'horizontal':
-                    x = random.randint(0, self.BOARD_SIZE - 1)
-                    y = random.randint(0, self.BOARD_SIZE - size)
-                    if all(board[x][y + i] == '🌊' for i in range(size)):
-                        for i in range(size):
-                            board[x][y + i] = '🛳️'
-                            ships[(x, y + i)] = size
-                        placed = True
-                else:  # vertical
-                    x = random.randint(0, self.BOARD_SIZE - size)
-                    y = random.randint(0, self.BOARD_SIZE - 1)
-                    if all(board[x + i][y] == '🌊' for i in range(size)):
-                        for i in range(size):
-                            board[x + i][y] = '🛳️'
-                            ships[(x + i, y)] = size
-                        placed = True
+    def place_ships(self, grid: bytearray) -> List[Tuple[int, ...]]:
+        ships = place_fleet(self.board_size, self.fleet)
+        for ship_id, cells in enumerate(ships, start=1):
+            for cell in cells:
+                grid[cell] = ship_id
         return ships
     
     def make_move(self, player: discord.Member, x: int, y: int) -> Tuple[bool, str, bool]:  # (valid_move, message, game_over)
@@ -247,39 +463,120 @@ class Battleship(GameState):
         if player != self.current_player:
             return False, "It's not your turn!", False
             
-        if x < 0 or x >= self.BOARD_SIZE or y < 0 or y >= self.BOARD_SIZE:
-            return False, f"Coordinates must be between 0 and {self.BOARD_SIZE - 1}.", False
+        if x < 0 or x >= self.board_size or y < 0 or y >= self.board_size:
+            return False, f"Coordinates must be between 1 and {self.board_size}.", False
             
-        if self.tracking_boards[player][x][y] != '🌊':
+        cell = x * self.board_size + y
+        shots = self.shots[player]
+        if shots[cell] != self.UNKNOWN:
             return False, "You've already targeted this location!", False
             
-        opponent_board = self.boards[opponent]
-        
-        if opponent_board[x][y] == '🛳️':  # Hit
-            self.tracking_boards[player][x][y] = '💥'
-            opponent_board[x][y] = '💥'
-            
-            # Check if ship is sunk
-            ship_positions = [pos for pos, size in self.ships[opponent].items() 
-                            if size == self.ships[opponent].get((x, y))]
-            
-            if all(opponent_board[px][py] == '💥' for px, py in ship_positions):
-                # Mark all positions of the sunk ship with '💀'
-                for px, py in ship_positions:
-                    self.tracking_boards[player][px][py] = '💀'
-                    opponent_board[px][py] = '💀'
-                
-                # Check if all ships are sunk
-                if all(cell != '🛳️' for row in opponent_board for cell in row):
-                    self.winner = player
-                    return True, "💥 Direct hit! You've sunk all the enemy ships! You win! 🎉", True
-                return True, f"💥 Direct hit! You've sunk a {ship_positions[0][1]}-length ship!", False
-            return True, "💥 Direct hit!", False
-        else:  # Miss
-            self.tracking_boards[player][x][y] = '❌'
+        ship_id = self.grids[opponent][cell]
+        if not ship_id:  # Miss
+            shots[cell] = self.MISS
             self.current_player = opponent
             return True, "💧 Missed!", False
+        
+        shots[cell] = self.HIT
+        self.remaining[opponent] -= 1
+        remaining = self.ship_remaining[opponent]
+        remaining[ship_id - 1] -= 1
+        if remaining[ship_id - 1]:
+            return True, "💥 Direct hit!", False
+        
+        # Sunk: mark the whole ship on the shooter's tracking grid
+        ship = self.ship_cells[opponent][ship_id - 1]
+        for ship_cell in ship:
+            shots[ship_cell] = self.SUNK
+        if not self.remaining[opponent]:
+            self.winner = player
+            return True, "💥 Direct hit! You've sunk all the enemy ships! You win! 🎉", True
+        return True, f"💥 Direct hit! You've sunk a {len(ship)}-length ship!", False
+    
+    def bot_turn(self) -> List[str]:
+        """Let the bot opponent fire until it misses or wins, describing each shot"""
+        lines = []
+        while self.ai is not None and not self.winner and self.current_player == self.bot_player:
+            target = self.player1
+            afloat = [size for size, left in zip(self.fleet, self.ship_remaining[target]) if left]
+            x, y = self.ai.choose(self.shots[self.bot_player], afloat)
+            self.make_move(self.bot_player, x, y)
+            
+            mark = self.shots[self.bot_player][x * self.board_size + y]
+            if self.winner:
+                result = "💀 sunk your last ship!"
+            elif mark == self.SUNK:
+                ship_id = self.grids[target][x * self.board_size + y]
+                result = f"💀 sunk your {len(self.ship_cells[target][ship_id - 1])}-length ship!"
+            elif mark == self.HIT:
+                result = "💥 hit!"
+            else:
+                result = "💧 missed."
+            lines.append(f"🤖 The bot fires at ({x + 1}, {y + 1}): {result}")
+        return lines
+    
+    def board_cells(self, player: discord.Member, show_ships: bool = False) -> List[str]:
+        """A player's tracking grid, or their own fleet with `show_ships`, as emoji row by row"""
+        size = self.board_size
+        if show_ships:
+            # The player's own fleet, with the opponent's shots on it
+            opponent = self.player2 if player == self.player1 else self.player1
+            grid, shots = self.grids[player], self.shots[opponent]
+            marks = ['💀' if shots[cell] == self.SUNK else '💥' if shots[cell] == self.HIT
+                     else '🛳️' if grid[cell] else '🌊' for cell in range(size * size)]
+        else:
+            symbols = ('🌊', '❌', '💥', '💀')
+            marks = [symbols[mark] for mark in self.shots[player]]
+        return marks
     
     def get_board_string(self, player: discord.Member, show_ships: bool = False) -> str:
-        board = self.boards[player] if show_ships else self.tracking_boards[player]
-        return '\n'.join(''.join(row) for row in board)
+        marks, size = self.board_cells(player, show_ships), self.board_size
+        return '\n'.join(''.join(marks[row * size:(row + 1) * size]) for row in range(size))
+
+@lru_cache(maxsize=None)
+def placement_matrix(board_size: int, size: int) -> np.ndarray:
+    """ship_placements as a (placements x cells) 0/1 matrix"""
+    placements = ship_placements(board_size, size)
+    matrix = np.zeros((len(placements), board_size * board_size), dtype=np.float32)
+    for row, (_, cells) in enumerate(placements):
+        matrix[row, list(cells)] = 1
+    matrix.setflags(write=False)
+    return matrix
+
+class BattleshipAI:
+    """Hunt/target opponent that fires at the cell covered by the most possible ship placements.
+
+    Every placement of every ship still afloat that avoids known misses and
+    sunk ships counts towards the cells it covers. While there are hits on
+    ships that are not sunk yet, placements through those hits are weighted
+    far higher, which turns the search into finishing off the damaged ship.
+    """
+
+    def __init__(self, board_size: int, target_weight: float = 50.0):
+        self.board_size = board_size
+        self.target_weight = target_weight
+
+    def density(self, shots: bytearray, ships: List[int]) -> np.ndarray:
+        marks = np.frombuffer(shots, dtype=np.uint8)
+        blocked = ((marks == Battleship.MISS) | (marks == Battleship.SUNK)).astype(np.float32)
+        hits = (marks == Battleship.HIT).astype(np.float32)
+        targeting = hits.any()
+
+        density = np.zeros(marks.size, dtype=np.float32)
+        for size, copies in Counter(ships).items():
+            matrix = placement_matrix(self.board_size, size)
+            weights = (matrix @ blocked == 0).astype(np.float32)
+            if targeting:
+                weights *= 1 + self.target_weight * (matrix @ hits)
+            density += copies * (weights @ matrix)
+        density[marks != Battleship.UNKNOWN] = 0
+        return density
+
+    def choose(self, shots: bytearray, ships: List[int]) -> Tuple[int, int]:
+        """Pick the (x, y) to fire at next, breaking ties at random"""
+        density = self.density(shots, ships)
+        if density.max() > 0:
+            candidates = np.flatnonzero(density == density.max())
+        else:
+            candidates = np.flatnonzero(np.frombuffer(shots, dtype=np.uint8) == Battleship.UNKNOWN)
+        return divmod(int(random.choice(candidates)), self.board_size)
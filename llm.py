@@ -0,0 +1,759 @@
+import os
+import re
+import json
+import time
+import hashlib
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, List, Optional, Set, Tuple
+
+import cohere
+import httpx
+import ollama
+
+# LLM client settings
+OLLAMA_HOST = os.getenv('OLLAMA_HOST', 'http://localhost:11434')
+GLM_MODEL = os.getenv('GLM_MODEL', 'glm-4.6:cloud')
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', 10))
+LLM_MAX_INFLIGHT = int(os.getenv('LLM_MAX_INFLIGHT', 4))
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 120))
+
+# Cohere settings
+COHERE_API_KEY = os.getenv('COHERE_API_KEY')
+COHERE_MODEL = os.getenv('COHERE_MODEL', 'command-a-03-2025')
+COHERE_BASE_URL = os.getenv('COHERE_BASE_URL')  # Override to point at a local stub server
+
+# Router settings
+LLM_BACKENDS = os.getenv('LLM_BACKENDS', 'ollama,cohere')  # Preferred order
+LLM_HEDGE_AFTER = float(os.getenv('LLM_HEDGE_AFTER', 10))  # Seconds before a hedged request is sent
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', 3))
+LLM_BREAKER_COOLDOWN = float(os.getenv('LLM_BREAKER_COOLDOWN', 30))
+
+# Scheduler settings
+LLM_MAX_CONCURRENT = int(os.getenv('LLM_MAX_CONCURRENT', LLM_MAX_INFLIGHT))
+LLM_MAX_QUEUE = int(os.getenv('LLM_MAX_QUEUE', 50))
+
+# Conversation memory settings
+CONVO_MAX_TURNS = int(os.getenv('CONVO_MAX_TURNS', 12))  # Messages kept verbatim per channel
+CONVO_TOKEN_BUDGET = int(os.getenv('CONVO_TOKEN_BUDGET', 1500))
+CONVO_MAX_CHANNELS = int(os.getenv('CONVO_MAX_CHANNELS', 1000))
+CONVO_IDLE_TTL = float(os.getenv('CONVO_IDLE_TTL', 60 * 60))
+CONVO_SUMMARY_CHARS = int(os.getenv('CONVO_SUMMARY_CHARS', 1200))
+
+# Response cache settings
+LLM_CACHE_SIZE = int(os.getenv('LLM_CACHE_SIZE', 512))
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', 24 * 60 * 60))
+LLM_CACHE_FILE = os.getenv('LLM_CACHE_FILE')  # Optional JSON file to persist the cache
+
+DEFAULT_OPTIONS = {
+    'temperature': 0.7,
+    'max_tokens': 1000
+}
+
+
+class GLMClient:
+    """Long-lived async Ollama client with a bounded connection pool.
+
+    A single instance is shared by the whole bot so the HTTP connections to
+    Ollama are reused, and a semaphore caps how many generations run at once.
+    """
+
+    name = 'ollama'
+
+    def __init__(self, host: str = OLLAMA_HOST, model: str = GLM_MODEL,
+                 max_connections: int = LLM_MAX_CONNECTIONS,
+                 max_inflight: int = LLM_MAX_INFLIGHT,
+                 timeout: float = LLM_TIMEOUT):
+        self.host = host
+        self.model = model
+        self.timeout = timeout
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_connections)
+        self.inflight = asyncio.Semaphore(max_inflight)
+        self.transport: Optional[httpx.AsyncHTTPTransport] = None  # Owns the connection pool
+        self._client: Optional[ollama.AsyncClient] = None
+
+    @property
+    def client(self) -> ollama.AsyncClient:
+        # Created lazily so the pool is bound to the running event loop
+        if self._client is None:
+            self.transport = httpx.AsyncHTTPTransport(limits=self.limits)
+            self._client = ollama.AsyncClient(host=self.host, timeout=self.timeout, transport=self.transport)
+        return self._client
+
+    async def chat(self, messages: List[Dict[str, str]], options: Optional[dict] = None) -> str:
+        """Run a chat completion and return the reply text"""
+        async with self.inflight:
+            response = await self.client.chat(
+                model=self.model,
+                messages=messages,
+                options=options or DEFAULT_OPTIONS
+            )
+
+        if response and 'message' in response and 'content' in response['message']:
+            return response['message']['content']
+        return ""
+
+    async def stream(self, messages: List[Dict[str, str]], options: Optional[dict] = None) -> AsyncIterator[str]:
+        """Run a chat completion and yield the reply text as Ollama produces it"""
+        async with self.inflight:
+            parts = await self.client.chat(
+                model=self.model,
+                messages=messages,
+                options=options or DEFAULT_OPTIONS,
+                stream=True
+            )
+            async for part in parts:
+                content = part['message']['content'] if part and 'message' in part else None
+                if content:
+                    yield content
+
+    async def close(self):
+        """Close the underlying HTTP connection pool"""
+        if self.transport is not None:
+            await self.transport.aclose()
+            self.transport = None
+            self._client = None
+
+
+
+class CohereClient:
+    """Long-lived async Cohere client with the same interface as GLMClient"""
+
+    name = 'cohere'
+
+    def __init__(self, api_key: Optional[str] = COHERE_API_KEY, model: str = COHERE_MODEL,
+                 base_url: Optional[str] = COHERE_BASE_URL, max_connections: int = LLM_MAX_CONNECTIONS,
+                 max_inflight: int = LLM_MAX_INFLIGHT, timeout: float = LLM_TIMEOUT):
+        self.api_key = api_key
+        self.model = model
+        self.base_url = base_url
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_connections)
+        self.timeout = timeout
+        self.inflight = asyncio.Semaphore(max_inflight)
+        self._http: Optional[httpx.AsyncClient] = None
+        self._client: Optional[cohere.AsyncClient] = None
+
+    @property
+    def client(self) -> cohere.AsyncClient:
+        if self._client is None:
+            self._http = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+            kwargs = {'base_url': self.base_url} if self.base_url else {}
+            self._client = cohere.AsyncClient(api_key=self.api_key, httpx_client=self._http, **kwargs)
+        return self._client
+
+    def _request(self, messages: List[Dict[str, str]], options: Optional[dict]) -> dict:
+        # Cohere takes the last message separately from the chat history
+        options = options or DEFAULT_OPTIONS
+        roles = {'user': 'USER', 'assistant': 'CHATBOT'}
+        preamble = "\n".join(m['content'] for m in messages if m['role'] == 'system')
+        history = [{'role': roles[m['role']], 'message': m['content']}
+                   for m in messages[:-1] if m['role'] in roles]
+
+        request = {
+            'message': messages[-1]['content'],
+            'model': self.model,
+            'temperature': options.get('temperature', 0.7),
+            'max_tokens': options.get('max_tokens', 1000)
+        }
+        if preamble:
+            request['preamble'] = preamble
+        if history:
+            request['chat_history'] = history
+        return request
+
+    async def chat(self, messages: List[Dict[str, str]], options: Optional[dict] = None) -> str:
+        """Run a chat completion and return the reply text"""
+        async with self.inflight:
+            response = await self.client.chat(**self._request(messages, options))
+        return response.text or ""
+
+    async def stream(self, messages: List[Dict[str, str]], options: Optional[dict] = None) -> AsyncIterator[str]:
+        """Run a chat completion and yield the reply text as Cohere produces it"""
+        async with self.inflight:
+            async for event in self.client.chat_stream(**self._request(messages, options)):
+                if event.event_type == 'text-generation' and event.text:
+                    yield event.text
+
+    async def close(self):
+        """Close the underlying HTTP connection pool"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+            self._client = None
+
+
+def cache_key(prompt: str, model: str, options: Optional[dict] = None, context: Optional[list] = None) -> str:
+    """Build a cache key from the normalized prompt, model, options and any conversation context.
+
+    An answer depends on the history it was generated with, so prompts with
+    context only hit the cache for that exact history. Prompts without
+    context are keyed on the prompt alone and shared across channels.
+    """
+    normalized = re.sub(r'\s+', ' ', prompt).strip().lower()
+    digest = hashlib.sha1(json.dumps(context).encode()).hexdigest() if context else ""
+    return json.dumps([normalized, model, options or DEFAULT_OPTIONS, digest], sort_keys=True)
+
+
+class ResponseCache:
+    """In-memory LRU cache of AI answers with TTL expiry.
+
+    If `path` is set, entries are loaded from and saved to a JSON file so
+    the cache survives restarts.
+    """
+
+    def __init__(self, max_size: int = LLM_CACHE_SIZE, ttl: float = LLM_CACHE_TTL,
+                 path: Optional[str] = LLM_CACHE_FILE, save_every: int = 20):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.save_every = save_every
+        self.entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._unsaved = 0
+        self.load()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.time():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, value: str):
+        self.entries[key] = (time.time() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+        self._unsaved += 1
+        if self._unsaved >= self.save_every:
+            self.save()
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+    def load(self):
+        """Load unexpired entries from the backing file, if any"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        now = time.time()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for key, expires, value in data[-self.max_size:]:
+                if expires > now:
+                    self.entries[key] = (expires, value)
+        except (OSError, ValueError, TypeError) as e:
+            # A damaged or foreign cache file must not stop the bot from starting
+            print(f"Could not load response cache: {e}")
+            self.entries.clear()
+
+    def save(self):
+        """Write the cache to the backing file, if any"""
+        self._unsaved = 0
+        if not self.path:
+            return
+        data = [[key, expires, value] for key, (expires, value) in self.entries.items()]
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not save response cache: {e}")
+
+
+class _Flight:
+    """One upstream call shared by every waiter on the same key"""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+
+class SingleFlight:
+    """Collapse concurrent identical requests into one upstream call.
+
+    Every caller with the same key shares a single producer and receives
+    the same chunks. When the last caller for a key goes away (e.g. it was
+    cancelled), the upstream call for that key is cancelled too.
+    """
+
+    def __init__(self):
+        self.flights: Dict[str, _Flight] = {}
+
+    async def run(self, key: str, func) -> str:
+        """Await `func()` once per key and share its text result"""
+        async def once():
+            yield await func()
+        return "".join([chunk async for chunk in self.stream(key, once)])
+
+    async def stream(self, key: str, factory) -> AsyncIterator[str]:
+        """Iterate `factory()` once per key and fan its chunks out to every caller"""
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = self.flights[key] = _Flight()
+            flight.task = asyncio.create_task(self._produce(key, flight, factory))
+
+        flight.waiters += 1
+        try:
+            i = 0
+            while True:
+                if i < len(flight.chunks):
+                    yield flight.chunks[i]
+                    i += 1
+                elif flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                else:
+                    await flight.changed.wait()
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.done:
+                # Nobody is listening any more, so stop the upstream call
+                flight.task.cancel()
+                self._forget(key, flight)
+
+    async def _produce(self, key: str, flight: _Flight, factory):
+        try:
+            async for chunk in factory():
+                flight.chunks.append(chunk)
+                self._notify(flight)
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            self._notify(flight)
+            self._forget(key, flight)
+
+    def _notify(self, flight: _Flight):
+        flight.changed.set()
+        flight.changed = asyncio.Event()
+
+    def _forget(self, key: str, flight: _Flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+
+class QueueFullError(Exception):
+    """Raised when the LLM request queue is at its maximum depth"""
+
+
+class RequestScheduler:
+    """Admission control for LLM generations.
+
+    At most `max_concurrent` generations run at once. Waiting requests are
+    served from the owner priority lane first, then round-robin across
+    guilds so one busy guild cannot starve the others. Once `max_queue`
+    requests are waiting, new ones are rejected with QueueFullError,
+    except for the priority lane, which is never turned away.
+    """
+
+    def __init__(self, max_concurrent: int = LLM_MAX_CONCURRENT, max_queue: int = LLM_MAX_QUEUE):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.active = 0
+        self.queued = 0
+        self.priority: Deque[asyncio.Future] = deque()
+        self.guild_queues: "OrderedDict[Optional[int], Deque[asyncio.Future]]" = OrderedDict()
+        self.avg_duration = 10.0  # Rolling average generation time in seconds
+
+    def estimate_wait(self, priority: bool = False) -> float:
+        """Estimate how long a new request would wait for a slot"""
+        ahead = len(self.priority) if priority else self.queued
+        return (ahead // self.max_concurrent + 1) * self.avg_duration
+
+    @asynccontextmanager
+    async def acquire(self, guild_id: Optional[int] = None, priority: bool = False, on_queued=None):
+        """Hold a generation slot, waiting in the queue if none is free.
+
+        `on_queued` is awaited with the estimated wait in seconds when the
+        request has to queue.
+        """
+        loop = asyncio.get_running_loop()
+        if self.active < self.max_concurrent and self.queued == 0:
+            self.active += 1
+        else:
+            if not priority and self.queued >= self.max_queue:
+                raise QueueFullError("Too many AI requests are waiting, please try again later.")
+
+            wait = self.estimate_wait(priority)
+            slot = loop.create_future()
+            if priority:
+                self.priority.append(slot)
+            else:
+                self.guild_queues.setdefault(guild_id, deque()).append(slot)
+            self.queued += 1
+
+            try:
+                if on_queued:
+                    await on_queued(wait)
+                await slot
+            except BaseException:
+                if slot.done() and not slot.cancelled():
+                    # The slot was handed over just as we gave up
+                    self._release()
+                else:
+                    slot.cancel()
+                    self._dequeue(slot, guild_id, priority)
+                raise
+
+        start = loop.time()
+        try:
+            yield
+        finally:
+            self.avg_duration = 0.8 * self.avg_duration + 0.2 * (loop.time() - start)
+            self._release()
+
+    def _release(self):
+        # Hand the slot straight to the next waiter, if there is one
+        slot = self._next()
+        if slot is None:
+            self.active -= 1
+        else:
+            slot.set_result(None)
+
+    def _next(self) -> Optional[asyncio.Future]:
+        if self.priority:
+            self.queued -= 1
+            return self.priority.popleft()
+        if self.guild_queues:
+            guild_id, queue = next(iter(self.guild_queues.items()))
+            slot = queue.popleft()
+            if queue:
+                self.guild_queues.move_to_end(guild_id)
+            else:
+                del self.guild_queues[guild_id]
+            self.queued -= 1
+            return slot
+        return None
+
+    def _dequeue(self, slot: asyncio.Future, guild_id: Optional[int], priority: bool):
+        queue = self.priority if priority else self.guild_queues.get(guild_id)
+        if queue is None or slot not in queue:
+            return
+        queue.remove(slot)
+        self.queued -= 1
+        if not priority and not queue:
+            del self.guild_queues[guild_id]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token)"""
+    return len(text) // 4 + 1
+
+
+class ChannelMemory:
+    """Recent turns and a running summary for one channel"""
+
+    def __init__(self, max_turns: int):
+        self.turns: Deque[Dict[str, str]] = deque()
+        self.max_turns = max_turns
+        self.summary = ""
+        self.pending: List[Dict[str, str]] = []
+        self.summarizing = False
+        self.last_used = time.monotonic()
+        self.last_key: Optional[str] = None  # Cache key of the last recorded turn
+
+
+class ConversationMemory:
+    """Bounded per-channel conversation history for the GLM model.
+
+    Each channel keeps its last `max_turns` messages. Before each call the
+    history is trimmed to `token_budget`, and turns that fall out are
+    folded into a running summary instead of being resent in full. At most
+    `max_channels` channels are kept, and channels idle for `idle_ttl`
+    seconds are dropped.
+
+    `summarize(summary, turns)` is an optional coroutine returning the
+    updated summary. Without it, a short extract of each turn is kept.
+    """
+
+    def __init__(self, max_turns: int = CONVO_MAX_TURNS, token_budget: int = CONVO_TOKEN_BUDGET,
+                 max_channels: int = CONVO_MAX_CHANNELS, idle_ttl: float = CONVO_IDLE_TTL,
+                 summary_chars: int = CONVO_SUMMARY_CHARS, summarize=None):
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.max_channels = max_channels
+        self.idle_ttl = idle_ttl
+        self.summary_chars = summary_chars
+        self.summarize = summarize
+        self.channels: "OrderedDict[int, ChannelMemory]" = OrderedDict()
+        self.tasks: Set[asyncio.Task] = set()  # Running summaries, kept so they are not garbage collected
+
+    def messages(self, channel_id: Optional[int], content: str) -> List[Dict[str, str]]:
+        """Build the messages for a new user prompt, including trimmed history"""
+        self._evict_idle()
+        current = {'role': 'user', 'content': content}
+        memory = self.channels.get(channel_id)
+        if memory is None:
+            return [current]
+        self._touch(channel_id, memory)
+
+        # Keep the newest turns that fit in the budget and fold the rest
+        budget = self.token_budget - estimate_tokens(content) - estimate_tokens(memory.summary)
+        kept = 0
+        for turn in reversed(memory.turns):
+            budget -= estimate_tokens(turn['content'])
+            if budget < 0:
+                break
+            kept += 1
+        if kept < len(memory.turns):
+            self._fold(memory, [memory.turns.popleft() for _ in range(len(memory.turns) - kept)])
+
+        messages = []
+        if memory.summary:
+            messages.append({'role': 'system', 'content': f"Summary of the earlier conversation: {memory.summary}"})
+        messages.extend(memory.turns)
+        messages.append(current)
+        return messages
+
+    def record(self, channel_id: Optional[int], prompt: str, answer: str, key: Optional[str] = None):
+        """Remember a completed question and answer for a channel.
+
+        `key` is the answer's cache key. Callers that shared one coalesced
+        generation pass the same key, so the turn is only recorded once.
+        """
+        memory = self.channels.get(channel_id)
+        if memory is not None and key is not None and memory.last_key == key:
+            return
+        if memory is None:
+            memory = self.channels[channel_id] = ChannelMemory(self.max_turns)
+            while len(self.channels) > self.max_channels:
+                self.channels.popitem(last=False)
+        self._touch(channel_id, memory)
+
+        memory.last_key = key
+        memory.turns.append({'role': 'user', 'content': prompt})
+        memory.turns.append({'role': 'assistant', 'content': answer})
+        overflow = len(memory.turns) - memory.max_turns
+        if overflow > 0:
+            self._fold(memory, [memory.turns.popleft() for _ in range(overflow)])
+
+    def forget(self, channel_id: Optional[int]):
+        self.channels.pop(channel_id, None)
+
+    def _touch(self, channel_id: Optional[int], memory: ChannelMemory):
+        memory.last_used = time.monotonic()
+        self.channels.move_to_end(channel_id)
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        while self.channels:
+            channel_id, memory = next(iter(self.channels.items()))
+            if memory.last_used >= cutoff:
+                break
+            del self.channels[channel_id]
+
+    def _fold(self, memory: ChannelMemory, turns: List[Dict[str, str]]):
+        if self.summarize is None:
+            memory.summary = self._extract(memory.summary, turns)
+            return
+        memory.pending.extend(turns)
+        if not memory.summarizing:
+            memory.summarizing = True
+            task = asyncio.create_task(self._summarize(memory))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _summarize(self, memory: ChannelMemory):
+        # Fold pending turns in batches until none are left
+        try:
+            while memory.pending:
+                turns, memory.pending = memory.pending, []
+                try:
+                    summary = await self.summarize(memory.summary, turns)
+                except Exception as e:
+                    print(f"Error summarizing conversation: {e}")
+                    summary = self._extract(memory.summary, turns)
+                memory.summary = summary[-self.summary_chars:]
+        finally:
+            memory.summarizing = False
+
+    def _extract(self, summary: str, turns: List[Dict[str, str]]) -> str:
+        lines = [f"{turn['role']}: {turn['content'][:100]}" for turn in turns]
+        return "\n".join(filter(None, [summary, *lines]))[-self.summary_chars:]
+
+
+class BackendStats:
+    """Rolling latency, error rate and circuit breaker state for one backend"""
+
+    def __init__(self, window: int = 20, max_failures: int = LLM_BREAKER_FAILURES,
+                 cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.latency: Optional[float] = None  # Exponentially weighted, in seconds
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+
+    @property
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    @property
+    def available(self) -> bool:
+        # After the cooldown one trial request is let through (half-open)
+        return time.monotonic() >= self.open_until
+
+    def success(self, latency: float):
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        self.outcomes.append(True)
+        self.failures = 0
+        self.open_until = 0.0
+
+    def failure(self):
+        self.outcomes.append(False)
+        self.failures += 1
+        if self.failures >= self.max_failures:
+            self.open_until = time.monotonic() + self.cooldown
+
+
+class LLMRouter:
+    """Route chat requests across LLM backends with latency-aware failover.
+
+    Requests go to the healthy backend with the best rolling latency and
+    error rate. If it has not answered (or, when streaming, produced a first
+    token) within `hedge_after` seconds, the next backend is tried in
+    parallel and the first to succeed wins. A backend that fails repeatedly
+    has its circuit opened for a cooldown period.
+    """
+
+    def __init__(self, backends: list, hedge_after: float = LLM_HEDGE_AFTER):
+        if not backends:
+            raise ValueError("LLMRouter needs at least one backend")
+        self.backends = backends
+        self.hedge_after = hedge_after
+        self.stats = {backend.name: BackendStats() for backend in backends}
+        self.model = "+".join(f"{backend.name}:{backend.model}" for backend in backends)
+
+    def ordered(self) -> list:
+        """Backends to try, best first"""
+        def score(backend):
+            stats = self.stats[backend.name]
+            # Untried backends count as slow so the configured order is kept
+            latency = self.hedge_after if stats.latency is None else stats.latency
+            return latency * (1 + 4 * stats.error_rate)
+
+        healthy = [b for b in self.backends if self.stats[b.name].available]
+        if not healthy:
+            # Every circuit is open, so try whichever reopens first
+            return sorted(self.backends, key=lambda b: self.stats[b.name].open_until)
+        return sorted(healthy, key=score)
+
+    async def chat(self, messages: List[Dict[str, str]], options: Optional[dict] = None) -> str:
+        """Run a chat completion on the best backend, hedging and failing over"""
+        loop = asyncio.get_running_loop()
+        candidates = self.ordered()
+        pending: Dict[asyncio.Task, Tuple[object, float]] = {}
+        error: Optional[Exception] = None
+
+        def launch():
+            backend = candidates.pop(0)
+            pending[asyncio.create_task(backend.chat(messages, options))] = (backend, loop.time())
+
+        launch()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, timeout=self.hedge_after if candidates else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch()  # Hedge the slow request
+                    continue
+                for task in done:
+                    backend, start = pending.pop(task)
+                    try:
+                        response = task.result()
+                    except Exception as e:
+                        self.stats[backend.name].failure()
+                        error = e
+                        continue
+                    self.stats[backend.name].success(loop.time() - start)
+                    return response
+                if not pending and candidates:
+                    launch()  # Fail over to the next backend
+        finally:
+            for task in pending:
+                task.cancel()
+        raise error
+
+    async def stream(self, messages: List[Dict[str, str]], options: Optional[dict] = None) -> AsyncIterator[str]:
+        """Stream a chat completion, hedging and failing over until the first token"""
+        loop = asyncio.get_running_loop()
+        candidates = self.ordered()
+        pending: Dict[asyncio.Task, Tuple[object, AsyncIterator[str], float]] = {}
+        error: Optional[Exception] = None
+        winner = None
+
+        def launch():
+            backend = candidates.pop(0)
+            parts = backend.stream(messages, options).__aiter__()
+            pending[asyncio.create_task(parts.__anext__())] = (backend, parts, loop.time())
+
+        launch()
+        try:
+            while pending and winner is None:
+                done, _ = await asyncio.wait(pending, timeout=self.hedge_after if candidates else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch()
+                    continue
+                for task in done:
+                    backend, parts, start = pending.pop(task)
+                    try:
+                        first = task.result()
+                    except StopAsyncIteration:
+                        first = None
+                    except Exception as e:
+                        self.stats[backend.name].failure()
+                        error = e
+                        continue
+                    self.stats[backend.name].success(loop.time() - start)
+                    winner = (backend, parts, first)
+                    break
+                if winner is None and not pending and candidates:
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        if winner is None:
+            raise error
+        backend, parts, first = winner
+        if first is None:
+            return
+
+        yield first
+        try:
+            async for chunk in parts:
+                yield chunk
+        except Exception:
+            self.stats[backend.name].failure()
+            raise
+
+    async def close(self):
+        for backend in self.backends:
+            await backend.close()
+
+
+def default_router(order: str = LLM_BACKENDS) -> LLMRouter:
+    """Build a router over the configured backends in the given preference order"""
+    factories = {'ollama': GLMClient, 'cohere': CohereClient}
+    names = [name.strip() for name in order.split(',') if name.strip() in factories]
+    if not COHERE_API_KEY and 'cohere' in names and len(names) > 1:
+        names.remove('cohere')
+    return LLMRouter([factories[name]() for name in names])
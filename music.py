@@ -0,0 +1,607 @@
+import os
+import re
+import time
+import uuid
+import random
+import asyncio
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from yt_dlp import YoutubeDL
+
+# Music settings
+MUSIC_WORKERS = int(os.getenv('MUSIC_WORKERS', 4))  # Threads used for yt-dlp calls
+MUSIC_SEARCH_TIMEOUT = float(os.getenv('MUSIC_SEARCH_TIMEOUT', 10))
+TRACK_CACHE_SIZE = int(os.getenv('TRACK_CACHE_SIZE', 1024))
+TRACK_CACHE_TTL = float(os.getenv('TRACK_CACHE_TTL', 6 * 60 * 60))
+PLAYLIST_MAX_TRACKS = int(os.getenv('PLAYLIST_MAX_TRACKS', 500))
+PLAYLIST_TIMEOUT = float(os.getenv('PLAYLIST_TIMEOUT', 30))
+PLAYLIST_FILL_WORKERS = int(os.getenv('PLAYLIST_FILL_WORKERS', 2))  # Background resolutions across all playlists
+PREFETCH_DEPTH = int(os.getenv('PREFETCH_DEPTH', 2))  # Upcoming tracks resolved ahead of time
+STREAM_CACHE_SIZE = int(os.getenv('STREAM_CACHE_SIZE', 2048))
+STREAM_EXPIRY_MARGIN = float(os.getenv('STREAM_EXPIRY_MARGIN', 10 * 60))  # Seconds before URL expiry to drop it
+STREAM_URL_TTL = 6 * 60 * 60  # Assumed lifetime of a stream URL without an expire parameter
+AUDIO_CACHE_DIR = os.getenv('AUDIO_CACHE_DIR')  # Local cache of hot tracks, disabled when unset
+AUDIO_CACHE_MAX_MB = int(os.getenv('AUDIO_CACHE_MAX_MB', 1024))
+AUDIO_CACHE_MIN_PLAYS = int(os.getenv('AUDIO_CACHE_MIN_PLAYS', 3))  # Plays before a track is cached
+
+SEARCH_OPTIONS = {
+    'format': 'bestaudio/best',
+    'quiet': True,
+    'extract_flat': True,
+    'skip_download': True,
+    'default_search': 'ytsearch',
+    'noplaylist': True
+}
+
+PLAYLIST_OPTIONS = {
+    'quiet': True,
+    'extract_flat': 'in_playlist',
+    'skip_download': True
+}
+
+STREAM_OPTIONS = {
+    'format': 'bestaudio[acodec=opus]/bestaudio/best',  # Opus can be sent to Discord without re-encoding
+    'noplaylist': True,
+    'quiet': True
+}
+
+
+
+class Track:
+    """Compact record for a queued track.
+
+    Playlist entries start as stubs whose title and duration may be
+    missing until the background fill resolves them.
+    """
+
+    __slots__ = ('id', 'title', 'duration')
+
+    def __init__(self, id: str, title: Optional[str] = None, duration: Optional[int] = None):
+        self.id = id
+        self.title = title
+        self.duration = duration
+
+    @property
+    def url(self) -> str:
+        return f"https://www.youtube.com/watch?v={self.id}"
+
+    @property
+    def name(self) -> str:
+        return self.title or self.url
+
+    def __repr__(self):
+        return f"Track({self.id!r}, {self.title!r}, {self.duration!r})"
+
+
+def format_duration(seconds: Optional[int]) -> str:
+    if not seconds:
+        return "?:??"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes}:{seconds:02}"
+
+
+class MusicQueue:
+    """Deque-backed music queue for one guild.
+
+    Enqueue and dequeue are O(1); bulk operations work on the deque in
+    place, and `page` only touches the tracks it returns.
+    """
+
+    def __init__(self):
+        self.tracks: Deque[Track] = deque()
+        self.current: Optional[Track] = None
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def add(self, track: Track):
+        self.tracks.append(track)
+
+    def extend(self, tracks: Iterable[Track]):
+        self.tracks.extend(tracks)
+
+    def insert(self, index: int, tracks: List[Track]):
+        """Insert several tracks before position `index` in one pass"""
+        index = max(0, min(index, len(self.tracks)))
+        self.tracks.rotate(-index)
+        self.tracks.extendleft(reversed(tracks))
+        self.tracks.rotate(index)
+
+    def pop(self) -> Optional[Track]:
+        return self.tracks.popleft() if self.tracks else None
+
+    def move(self, source: int, target: int) -> Track:
+        """Move the track at `source` to position `target`"""
+        track = self.tracks[source]
+        del self.tracks[source]
+        self.tracks.insert(target, track)
+        return track
+
+    def remove_range(self, start: int, end: int) -> int:
+        """Remove tracks in [start, end) and return how many were removed"""
+        start = max(0, start)
+        count = max(0, min(end, len(self.tracks)) - start)
+        self.tracks.rotate(-start)
+        for _ in range(count):
+            self.tracks.popleft()
+        self.tracks.rotate(start)
+        return count
+
+    def shuffle(self):
+        tracks = list(self.tracks)
+        random.shuffle(tracks)
+        self.tracks = deque(tracks)
+
+    def clear(self):
+        self.tracks.clear()
+        self.current = None
+
+    def upcoming(self, count: int) -> List[Track]:
+        return list(islice(self.tracks, count))
+
+    def page(self, number: int, per_page: int = 10) -> List[Tuple[int, Track]]:
+        """Return (position, track) pairs for a 1-based page of the queue"""
+        start = (number - 1) * per_page
+        return list(enumerate(islice(self.tracks, start, start + per_page), start + 1))
+
+
+# yt-dlp blocks, so it always runs on this pool instead of the event loop
+extractor_pool = ThreadPoolExecutor(max_workers=MUSIC_WORKERS, thread_name_prefix='yt-dlp')
+# Playlist fills may only use part of the pool, so searches and track handoffs always find a free worker
+fill_slots = asyncio.Semaphore(max(1, min(PLAYLIST_FILL_WORKERS, MUSIC_WORKERS - 1)))
+
+
+class TTLCache:
+    """Small LRU cache whose entries also expire after `ttl` seconds"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self.entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def pop(self, key: str):
+        self.entries.pop(key, None)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+track_cache = TTLCache(TRACK_CACHE_SIZE, TRACK_CACHE_TTL)
+
+
+def search_yt(query: str) -> Optional[Track]:
+    """Search YouTube and return the first result's metadata (blocking)"""
+    with YoutubeDL(SEARCH_OPTIONS) as ydl:
+        try:
+            if urlparse(query).scheme.startswith('http') and video_id(query) != query:
+                # Look up the linked video itself, without any list= it was shared from
+                entry = ydl.extract_info(Track(video_id(query)).url, download=False)
+                return Track(entry['id'], entry.get('title'), entry.get('duration')) if entry else None
+
+            info = ydl.extract_info(f"ytsearch:{query}", download=False)
+            if not info or 'entries' not in info or not info['entries']:
+                return None
+
+            entry = info['entries'][0]
+            return Track(entry['id'], entry.get('title'), entry.get('duration'))
+        except Exception as e:
+            print(f"Error searching YouTube: {e}")
+            return None
+
+
+async def find_track(query: str) -> Optional[Track]:
+    """Resolve a search query to track metadata without blocking the event loop.
+
+    Results are cached by normalized query, so repeated requests for the
+    same song return immediately.
+    """
+    key = re.sub(r'\s+', ' ', query).strip().lower()
+    track = track_cache.get(key)
+    if track is not None:
+        return track
+
+    loop = asyncio.get_running_loop()
+    try:
+        track = await asyncio.wait_for(
+            loop.run_in_executor(extractor_pool, search_yt, query),
+            timeout=MUSIC_SEARCH_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        print(f"YouTube search timed out for: {query}")
+        return None
+
+    if track is not None:
+        track_cache.set(key, track)
+    return track
+
+
+def is_playlist(query: str) -> bool:
+    """Check whether a /play query is a playlist URL.
+
+    A video link that was shared from a playlist (`watch?v=...&list=...`)
+    plays just that video, and YouTube Mixes (`RD` lists) are never
+    expanded, since they are endless autoplay lists.
+    """
+    parsed = urlparse(query)
+    if not parsed.scheme.startswith('http'):
+        return False
+    params = parse_qs(parsed.query)
+    playlist_id = params.get('list', [''])[0]
+    if not playlist_id or playlist_id.startswith('RD'):
+        return False
+    return parsed.path.startswith('/playlist') or video_id(query) == query
+
+
+def list_playlist(url: str) -> List[Track]:
+    """List a playlist's entries as track stubs in a single flat call (blocking)"""
+    with YoutubeDL(PLAYLIST_OPTIONS) as ydl:
+        try:
+            info = ydl.extract_info(url, download=False)
+        except Exception as e:
+            print(f"Error listing playlist {url}: {e}")
+            return []
+    entries = (info or {}).get('entries') or []
+    return [Track(entry['id'], entry.get('title'), entry.get('duration'))
+            for entry in islice(entries, PLAYLIST_MAX_TRACKS) if entry and entry.get('id')]
+
+
+async def load_playlist(url: str) -> List[Track]:
+    """List a playlist on the extractor pool"""
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(
+            loop.run_in_executor(extractor_pool, list_playlist, url),
+            timeout=PLAYLIST_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        print(f"Timed out listing playlist {url}")
+        return []
+
+
+def stream_expiry(stream_url: str) -> float:
+    """Read the expiry time (epoch seconds) of a signed stream URL"""
+    expire = parse_qs(urlparse(stream_url).query).get('expire')
+    if expire and expire[0].isdigit():
+        return float(expire[0])
+    return time.time() + STREAM_URL_TTL
+
+
+def video_id(url: str) -> str:
+    """Extract the YouTube video ID from a track URL, or return the URL itself"""
+    parsed = urlparse(url)
+    if parsed.hostname and parsed.hostname.endswith('youtu.be'):
+        return parsed.path.lstrip('/') or url
+    return parse_qs(parsed.query).get('v', [url])[0]
+
+
+def extract_stream(url: str) -> Optional[dict]:
+    """Resolve a track URL to its direct audio stream and format details (blocking)"""
+    with YoutubeDL(STREAM_OPTIONS) as ydl:
+        try:
+            info = ydl.extract_info(url, download=False)
+        except Exception as e:
+            print(f"Error resolving stream for {url}: {e}")
+            return None
+    return {
+        'url': info['url'],
+        'expires': stream_expiry(info['url']),
+        'format_id': info.get('format_id'),
+        'ext': info.get('ext'),
+        'acodec': info.get('acodec'),
+        'abr': info.get('abr'),
+        'asr': info.get('asr'),
+        'protocol': info.get('protocol'),
+        'title': info.get('title'),
+        'duration': info.get('duration')
+    }
+
+
+class StreamCache:
+    """Resolved stream URLs by video ID, shared by every guild.
+
+    Entries are evicted `margin` seconds before their signed URL expires,
+    and concurrent lookups for the same video share one extractor call.
+    """
+
+    def __init__(self, max_size: int = STREAM_CACHE_SIZE, margin: float = STREAM_EXPIRY_MARGIN):
+        self.margin = margin
+        self.cache = TTLCache(max_size, STREAM_URL_TTL)
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, url: str) -> Optional[dict]:
+        key = video_id(url)
+        stream = self.cache.get(key)
+        if stream is not None:
+            self.hits += 1
+            return stream
+
+        future = self.pending.get(key)
+        if future is None:
+            self.misses += 1
+            future = self.pending[key] = asyncio.get_running_loop().run_in_executor(
+                extractor_pool, extract_stream, url
+            )
+            future.add_done_callback(lambda _: self._forget(key, future))
+        else:
+            # Another guild is already resolving this video
+            self.hits += 1
+
+        try:
+            stream = await asyncio.wait_for(asyncio.shield(future), timeout=MUSIC_SEARCH_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"Timed out resolving stream for {url}")
+            return None
+
+        if stream is not None:
+            ttl = stream['expires'] - time.time() - self.margin
+            if ttl > 0:
+                self.cache.set(key, stream, ttl=ttl)
+        return stream
+
+    def _forget(self, key: str, future: asyncio.Future):
+        if self.pending.get(key) is future:
+            del self.pending[key]
+
+
+stream_cache = StreamCache()
+
+
+async def resolve_stream(url: str) -> Optional[dict]:
+    """Resolve a track's stream URL, using the shared stream cache"""
+    return await stream_cache.get(url)
+
+
+class Prefetcher:
+    """Resolves stream URLs for a guild's upcoming tracks while music plays.
+
+    Each prefetched URL is kept fresh by re-resolving it shortly before it
+    expires, so the next track can start as soon as the current one ends.
+    """
+
+    def __init__(self, depth: int = PREFETCH_DEPTH, refresh_margin: float = STREAM_EXPIRY_MARGIN):
+        self.depth = depth
+        self.refresh_margin = refresh_margin
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.resolved: Dict[str, asyncio.Event] = {}
+        self.ready: Dict[str, dict] = {}
+
+    def update(self, upcoming: List[str]):
+        """Prefetch the first `depth` upcoming tracks and drop the rest"""
+        wanted = upcoming[:self.depth]
+        for url in list(self.tasks):
+            if url not in wanted:
+                self._drop(url)
+        for url in wanted:
+            if url not in self.tasks:
+                self.resolved[url] = asyncio.Event()
+                self.tasks[url] = asyncio.create_task(self._keep_fresh(url))
+
+    async def take(self, url: str) -> Optional[dict]:
+        """Get a track's stream, resolving it now if it was not prefetched"""
+        resolved = self.resolved.get(url)
+        if resolved is not None and not resolved.is_set():
+            # Resolution is already under way, so wait for it instead of starting over
+            try:
+                await asyncio.wait_for(resolved.wait(), timeout=MUSIC_SEARCH_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+
+        stream = self.ready.get(url)
+        self._drop(url)
+        if stream is not None and stream['expires'] - time.time() > self.refresh_margin:
+            return stream
+        return await resolve_stream(url)
+
+    def clear(self):
+        for url in list(self.tasks):
+            self._drop(url)
+
+    async def _keep_fresh(self, url: str):
+        try:
+            while True:
+                stream = await resolve_stream(url)
+                if stream is None:
+                    return
+                self.ready[url] = stream
+                self.resolved[url].set()
+                await asyncio.sleep(max(stream['expires'] - time.time() - self.refresh_margin, 60))
+        finally:
+            if url in self.resolved:
+                self.resolved[url].set()
+
+    def _drop(self, url: str):
+        task = self.tasks.pop(url, None)
+        if task is not None:
+            task.cancel()
+        self.resolved.pop(url, None)
+        self.ready.pop(url, None)
+
+
+async def fill_tracks(tracks: List[Track], workers: int = PLAYLIST_FILL_WORKERS):
+    """Resolve metadata and stream URLs for track stubs in the background.
+
+    A fixed number of workers pull from the list, and every resolution
+    also takes one of the `fill_slots` shared by all playlists, so imports
+    in many guilds at once never occupy the whole extractor pool.
+    """
+    pending = iter(tracks)
+
+    async def worker():
+        for track in pending:
+            async with fill_slots:
+                stream = await resolve_stream(track.url)
+            if stream is not None:
+                track.title = track.title or stream['title']
+                track.duration = track.duration or stream['duration']
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+
+
+class AudioCache:
+    """Size-bounded on-disk cache of frequently played tracks as Opus files.
+
+    A track is downloaded in the background once it has been played
+    `min_plays` times. Downloads go to a temporary file that is renamed
+    into place when complete, and the least recently played files are
+    deleted once the cache grows past `max_bytes`.
+    """
+
+    def __init__(self, directory: Optional[str] = AUDIO_CACHE_DIR,
+                 max_bytes: int = AUDIO_CACHE_MAX_MB * 1024 * 1024,
+                 min_plays: int = AUDIO_CACHE_MIN_PLAYS, max_tracked: int = 10000):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.min_plays = min_plays
+        self.max_tracked = max_tracked
+        self.files: "OrderedDict[str, int]" = OrderedDict()  # Video ID -> size, least recent first
+        self.size = 0
+        self.plays: "OrderedDict[str, int]" = OrderedDict()
+        self.downloads: Dict[str, asyncio.Task] = {}
+        if directory:
+            self._scan()
+
+    def _path(self, track_id: str) -> str:
+        return os.path.join(self.directory, f"{track_id}.opus")
+
+    def _scan(self):
+        # Rebuild the index from disk, oldest access first, and drop unfinished downloads
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.part'):
+                os.remove(path)
+            elif name.endswith('.opus'):
+                stat = os.stat(path)
+                entries.append((stat.st_atime, name[:-len('.opus')], stat.st_size))
+        for _, track_id, size in sorted(entries):
+            self.files[track_id] = size
+            self.size += size
+        self._evict()
+
+    def has(self, track_id: str) -> bool:
+        return track_id in self.files
+
+    def path(self, track_id: str) -> Optional[str]:
+        """Path of a cached track, marking it as recently played"""
+        if track_id not in self.files:
+            return None
+        self.files.move_to_end(track_id)
+        return self._path(track_id)
+
+    def record_play(self, track_id: str, stream: Optional[dict]):
+        """Count a play and start caching the track once it is hot"""
+        if not self.directory:
+            return
+        self.plays[track_id] = self.plays.get(track_id, 0) + 1
+        self.plays.move_to_end(track_id)
+        while len(self.plays) > self.max_tracked:
+            self.plays.popitem(last=False)
+
+        if (stream is not None and self.plays[track_id] >= self.min_plays
+                and track_id not in self.files and track_id not in self.downloads):
+            task = asyncio.create_task(self._download(track_id, stream))
+            self.downloads[track_id] = task
+            task.add_done_callback(lambda _: self.downloads.pop(track_id, None))
+
+    async def _download(self, track_id: str, stream: dict):
+        # A unique temporary name keeps concurrent downloads from clobbering each other
+        tmp_path = os.path.join(self.directory, f"{track_id}.{uuid.uuid4().hex}.part")
+        codec = 'copy' if stream.get('acodec') == 'opus' else 'libopus'
+        try:
+            process = await asyncio.create_subprocess_exec(
+                'ffmpeg', '-nostdin', '-loglevel', 'error', '-y', '-i', stream['url'],
+                '-vn', '-c:a', codec, '-f', 'opus', tmp_path,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+            )
+            try:
+                if await process.wait() != 0:
+                    print(f"Failed to cache audio for {track_id}")
+                    return
+            except asyncio.CancelledError:
+                process.kill()
+                raise
+
+            size = os.path.getsize(tmp_path)
+            if size > self.max_bytes:
+                return
+            os.replace(tmp_path, self._path(track_id))
+            self.size += size - self.files.pop(track_id, 0)
+            self.files[track_id] = size
+            self._evict()
+        except OSError as e:
+            print(f"Error caching audio for {track_id}: {e}")
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _evict(self):
+        while self.size > self.max_bytes and self.files:
+            track_id, size = self.files.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(self._path(track_id))
+            except OSError:
+                pass
+
+
+audio_cache = AudioCache()
+
+
+def prefetch_queue(queue: MusicQueue, prefetcher: Prefetcher, cache: AudioCache = audio_cache):
+    """Start resolving the next tracks in a queue that are not cached on disk"""
+    upcoming = [track for track in queue.upcoming(prefetcher.depth) if not cache.has(track.id)]
+    prefetcher.update([track.url for track in upcoming])
+
+
+async def play_next_track(queue: MusicQueue, prefetcher: Prefetcher,
+                          play: Callable[[Optional[dict], Optional[str]], bool],
+                          cache: AudioCache = audio_cache) -> bool:
+    """Start the next playable track in a queue and return whether one started.
+
+    `play(stream, cached_path)` hands the track to the voice client and
+    returns False if it cannot, e.g. because something else is already
+    playing. The track then goes back to the front of the queue. Tracks
+    whose stream cannot be resolved are skipped.
+    """
+    while queue:
+        track = queue.pop()
+
+        # Usually already cached on disk or resolved while the previous track was playing
+        cached_path = cache.path(track.id)
+        stream = None if cached_path else await prefetcher.take(track.url)
+        if not cached_path and stream is None:
+            continue
+        if not play(stream, cached_path):
+            queue.insert(0, [track])
+            return False
+        queue.current = track
+        cache.record_play(track.id, stream)
+        prefetch_queue(queue, prefetcher, cache)
+        return True
+
+    queue.current = None
+    return False
@@ -0,0 +1,226 @@
+import os
+import io
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+# Board rendering settings
+RENDER_FORMAT = os.getenv('RENDER_FORMAT', 'png').lower()  # 'png' or 'webp'
+RENDER_CELL_SIZE = int(os.getenv('RENDER_CELL_SIZE', 48))
+RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', 512))  # Encoded images kept in memory
+RENDER_CANVAS_CACHE = int(os.getenv('RENDER_CANVAS_CACHE', 32))  # Board canvases kept for redraws, ~1 MB each
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', 2))
+
+BACKGROUND = (32, 34, 37)
+LABEL_COLOR = (220, 221, 222)
+WATER = (38, 99, 160)
+
+
+class SpriteAtlas:
+    """All cell sprites drawn once into a single image, keyed by the emoji the games use"""
+
+    SPRITES = ('⬜', '❌', '⭕', '🌊', '🛳️', '💥', '💀', 'miss')
+
+    def __init__(self, cell_size: int = RENDER_CELL_SIZE):
+        self.cell_size = cell_size
+        self.image = Image.new('RGB', (cell_size * len(self.SPRITES), cell_size), BACKGROUND)
+        draw = ImageDraw.Draw(self.image)
+        for index, name in enumerate(self.SPRITES):
+            self._draw(draw, name, index * cell_size)
+        self.sprites: Dict[str, Image.Image] = {
+            name: self.image.crop((index * cell_size, 0, (index + 1) * cell_size, cell_size))
+            for index, name in enumerate(self.SPRITES)
+        }
+
+    def _draw(self, draw: ImageDraw.ImageDraw, name: str, left: int):
+        size = self.cell_size
+        pad = size // 6
+        box = (left + 1, 1, left + size - 2, size - 2)
+        inner = (left + pad, pad, left + size - pad - 1, size - pad - 1)
+        width = max(size // 12, 2)
+        if name == '⬜':
+            draw.rectangle(box, fill=(235, 235, 235), outline=(180, 180, 180))
+        elif name in ('❌', '⭕'):
+            draw.rectangle(box, fill=(235, 235, 235), outline=(180, 180, 180))
+            if name == '❌':
+                draw.line((inner[0], inner[1], inner[2], inner[3]), fill=(221, 46, 68), width=width)
+                draw.line((inner[0], inner[3], inner[2], inner[1]), fill=(221, 46, 68), width=width)
+            else:
+                draw.ellipse(inner, outline=(59, 136, 195), width=width)
+        else:
+            draw.rectangle(box, fill=WATER, outline=(28, 75, 122))
+            if name == '🛳️':
+                draw.rounded_rectangle(inner, radius=pad, fill=(140, 146, 153), outline=(90, 95, 100))
+            elif name == '💥':
+                draw.ellipse(inner, fill=(244, 144, 12), outline=(221, 46, 68), width=width)
+            elif name == 'miss':
+                draw.ellipse((left + 2 * pad, 2 * pad, left + size - 2 * pad - 1, size - 2 * pad - 1), fill=(200, 220, 235))
+            elif name == '💀':
+                draw.rectangle(box, fill=(90, 20, 25), outline=(28, 75, 122))
+                draw.line((inner[0], inner[1], inner[2], inner[3]), fill=(20, 20, 20), width=width)
+                draw.line((inner[0], inner[3], inner[2], inner[1]), fill=(20, 20, 20), width=width)
+
+    def sprite(self, name: str, sea: bool = False) -> Image.Image:
+        # Battleship marks misses with the same cross as a Tic-Tac-Toe X
+        if sea and name == '❌':
+            name = 'miss'
+        return self.sprites.get(name) or self.sprites['⬜']
+
+
+class Canvas:
+    """Last rendered image of one board, so the next render only redraws changed cells"""
+
+    def __init__(self, image: Image.Image, cell_count: int, margin: int = 0):
+        self.image = image
+        self.margin = margin
+        self.cells: List[Optional[str]] = [None] * cell_count
+        self.lock = threading.Lock()
+
+
+class BoardRenderer:
+    """Renders game boards to PNG or WebP images.
+
+    Each board keeps its last image, and a new render pastes atlas sprites
+    only into the cells that changed. Encoded images are cached by a hash
+    of the board's contents, so an unchanged board is never encoded twice.
+    Drawing and encoding run on a small thread pool, off the event loop.
+    """
+
+    def __init__(self, cell_size: int = RENDER_CELL_SIZE, image_format: str = RENDER_FORMAT,
+                 cache_size: int = RENDER_CACHE_SIZE, canvas_cache_size: int = RENDER_CANVAS_CACHE,
+                 workers: int = RENDER_WORKERS):
+        self.atlas = SpriteAtlas(cell_size)
+        self.cell_size = cell_size
+        self.image_format = 'webp' if image_format == 'webp' else 'png'
+        self.cache_size = cache_size
+        self.canvas_cache_size = canvas_cache_size
+        self.encoded: "OrderedDict[str, bytes]" = OrderedDict()  # Board hash -> encoded image
+        self.canvases: "OrderedDict[str, Canvas]" = OrderedDict()  # Surface -> last rendered board
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='render')
+        try:
+            self.font = ImageFont.load_default(size=cell_size // 3)
+        except TypeError:  # Pillow < 10.1 only has the fixed-size bitmap font
+            self.font = ImageFont.load_default()
+
+    def _cached(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            data = self.encoded.get(key)
+            if data is not None:
+                self.encoded.move_to_end(key)
+            return data
+
+    def _store(self, key: str, data: bytes):
+        with self.lock:
+            self.encoded[key] = data
+            while len(self.encoded) > self.cache_size:
+                self.encoded.popitem(last=False)
+
+    def _encode(self, image: Image.Image) -> bytes:
+        buffer = io.BytesIO()
+        if self.image_format == 'webp':
+            image.save(buffer, 'WEBP', lossless=True, method=0)
+        else:
+            image.save(buffer, 'PNG', compress_level=1)
+        return buffer.getvalue()
+
+    def _canvas(self, surface: str, cell_count: int, columns: int, labels: bool) -> Canvas:
+        with self.lock:
+            canvas = self.canvases.get(surface)
+            if canvas is not None and len(canvas.cells) == cell_count:
+                self.canvases.move_to_end(surface)
+                return canvas
+
+            rows = -(-cell_count // columns)
+            margin = self.cell_size // 2 if labels else 0
+            image = Image.new('RGB', (margin + columns * self.cell_size, margin + rows * self.cell_size), BACKGROUND)
+            if labels:
+                draw = ImageDraw.Draw(image)
+                for index in range(max(rows, columns)):
+                    offset = margin + index * self.cell_size + self.cell_size // 2
+                    if index < columns:
+                        draw.text((offset, margin // 2), str(index + 1), fill=LABEL_COLOR, font=self.font, anchor='mm')
+                    if index < rows:
+                        draw.text((margin // 2, offset), str(index + 1), fill=LABEL_COLOR, font=self.font, anchor='mm')
+            canvas = Canvas(image, cell_count, margin)
+            self.canvases[surface] = canvas
+            while len(self.canvases) > self.canvas_cache_size:
+                self.canvases.popitem(last=False)
+            return canvas
+
+    def forget(self, prefix: str):
+        """Drop the canvases of every board whose surface name starts with `prefix`"""
+        with self.lock:
+            for surface in [surface for surface in self.canvases if surface.startswith(prefix)]:
+                del self.canvases[surface]
+
+    def _draw_grid(self, surface: str, key: str, cells: Sequence[str], columns: int, labels: bool, sea: bool) -> bytes:
+        canvas = self._canvas(surface, len(cells), columns, labels)
+        with canvas.lock:
+            for index, cell in enumerate(cells):
+                if canvas.cells[index] != cell:
+                    row, column = divmod(index, columns)
+                    position = (canvas.margin + column * self.cell_size, canvas.margin + row * self.cell_size)
+                    canvas.image.paste(self.atlas.sprite(cell, sea), position)
+                    canvas.cells[index] = cell
+            data = self._encode(canvas.image)
+        self._store(key, data)
+        return data
+
+    async def render_grid(self, surface: str, cells: Sequence[str], columns: int,
+                          labels: bool = False, sea: bool = False) -> bytes:
+        """Render a grid of emoji cells, given row by row, for the board named `surface`.
+
+        `labels` adds row and column numbers, `sea` draws crosses as Battleship misses.
+        """
+        key = hashlib.sha1(f"{columns}|{labels}|{sea}|{'|'.join(cells)}".encode('utf-8')).hexdigest()
+        data = self._cached(key)
+        if data is not None:
+            return data
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._draw_grid, surface, key, list(cells), columns, labels, sea)
+
+    def _draw_hangman(self, key: str, stage: int, display: str) -> bytes:
+        size = self.cell_size * 5
+        image = Image.new('RGB', (size, size + self.cell_size), BACKGROUND)
+        draw = ImageDraw.Draw(image)
+        unit = size // 10
+        width = max(unit // 3, 2)
+        color = LABEL_COLOR
+        # Gallows
+        draw.line((unit, 9 * unit, 5 * unit, 9 * unit), fill=color, width=width)
+        draw.line((2 * unit, 9 * unit, 2 * unit, unit), fill=color, width=width)
+        draw.line((2 * unit, unit, 6 * unit, unit), fill=color, width=width)
+        draw.line((6 * unit, unit, 6 * unit, 2 * unit), fill=color, width=width)
+        # One body part per wrong guess, in the same order as the text stages
+        parts: List[Tuple[str, Tuple[int, ...]]] = [
+            ('ellipse', (5 * unit, 2 * unit, 7 * unit, 4 * unit)),
+            ('line', (6 * unit, 4 * unit, 6 * unit, 6 * unit)),
+            ('line', (6 * unit, 4 * unit + unit // 2, 5 * unit, 5 * unit + unit // 2)),
+            ('line', (6 * unit, 4 * unit + unit // 2, 7 * unit, 5 * unit + unit // 2)),
+            ('line', (6 * unit, 6 * unit, 5 * unit, 7 * unit + unit // 2)),
+            ('line', (6 * unit, 6 * unit, 7 * unit, 7 * unit + unit // 2))
+        ]
+        for shape, box in parts[:stage]:
+            if shape == 'ellipse':
+                draw.ellipse(box, outline=(221, 46, 68), width=width)
+            else:
+                draw.line(box, fill=(221, 46, 68), width=width)
+        draw.text((size // 2, size + self.cell_size // 2), display, fill=color, font=self.font, anchor='mm')
+        data = self._encode(image)
+        self._store(key, data)
+        return data
+
+    async def render_hangman(self, stage: int, display: str) -> bytes:
+        """Render the gallows for `stage` wrong guesses with the word as guessed so far"""
+        key = hashlib.sha1(f"hangman|{stage}|{display}".encode('utf-8')).hexdigest()
+        data = self._cached(key)
+        if data is not None:
+            return data
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._draw_hangman, key, stage, display)
@@ -1,16 +1,20 @@
 from flask import Flask, request, jsonify, send_from_directory, url_for, session, copy_current_request_context
-from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_cors import CORS
 from dotenv import load_dotenv
 import os
-import cohere
 import json
-import asyncio
-import threading
 import logging
 from werkzeug.utils import secure_filename
 from datetime import datetime
 import uuid
+from contextlib import asynccontextmanager
+from a2wsgi import WSGIMiddleware
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+import socketio
+from llm import default_router
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -23,8 +27,8 @@ app = Flask(__name__, static_folder='.', static_url_path='')
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET', 'dev-secret-key')
 CORS(app)
 
-# Initialize SocketIO with CORS
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading', logger=True, engineio_logger=True)
+# Initialize Socket.IO with CORS, served as ASGI so WebSocket connections don't each hold a thread
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins="*", logger=True, engineio_logger=True)
 
 # Configure upload folder
 UPLOAD_FOLDER = 'uploads'
@@ -38,8 +42,9 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Initialize Cohere with your API key
-co = cohere.Client(os.getenv('COHERE_API_KEY'))
+# LLM router (Cohere first, Ollama as fallback)
+llm_router = default_router(os.getenv('SERVER_LLM_BACKENDS', 'cohere,ollama'))
+CHAT_OPTIONS = {'temperature': 0.7, 'max_tokens': 1024}
 
 # Serve index.html at the root URL
 @app.route('/')
@@ -47,57 +52,40 @@ def serve_index():
     return send_from_directory('.', 'index.html')
 
 # WebSocket event handlers
-@socketio.on('connect')
-def handle_connect():
+@sio.on('connect')
+async def handle_connect(sid, environ, auth=None):
     logger.info('Client connected')
-    emit('connected', {'data': 'Connected to WebSocket'})
+    await sio.emit('connected', {'data': 'Connected to WebSocket'}, to=sid)
 
-@socketio.on('disconnect')
-def handle_disconnect():
+@sio.on('disconnect')
+async def handle_disconnect(sid, *args):
     logger.info('Client disconnected')
 
-@socketio.on('send_message')
-def handle_send_message(data):
+@sio.on('send_message')
+async def handle_send_message(sid, data):
     """Handle messages from the web client"""
     logger.info(f'Received message from client: {data}')
     # Forward the message to all clients in the same channel
-    emit('new_message', {
+    await sio.emit('new_message', {
         'user': data.get('user', 'Anonymous'),
         'content': data.get('content', ''),
         'channel': data.get('channel', 'general'),
         'timestamp': datetime.utcnow().isoformat()
-    }, broadcast=True, include_self=False)
+    }, skip_sid=sid)
 
     # Here you would typically forward the message to the Discord bot
     # For now, we'll just echo it back
-    emit('new_message', {
+    await sio.emit('new_message', {
         'user': 'Bot',
         'content': f'You said: {data.get("content", "")}',
         'channel': data.get('channel', 'general'),
         'timestamp': datetime.utcnow().isoformat()
-    })
+    }, to=sid)
 
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
-# API endpoint for chat
-@app.route('/api/chat', methods=['POST'])
-def chat():
-    try:
-        data = request.json
-        response = co.chat(
-            message=data['prompt'],
-            model='command-a-03-2025',
-            temperature=0.7,
-            max_tokens=1024,
-            k=0,
-            stop_sequences=[]
-        )
-        return jsonify({'response': response.text})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
@@ -127,19 +115,60 @@ def upload_file():
     
     return jsonify({'error': 'File type not allowed'}), 400
 
-def run_flask():
+@asynccontextmanager
+async def lifespan(api: FastAPI):
+    yield
+    await llm_router.close()
+
+# ASGI app: async chat endpoints, with the Flask app mounted for everything else
+api = FastAPI(lifespan=lifespan)
+api.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+
+async def read_prompt(request: Request) -> str:
+    """Read the prompt from the JSON body, or the query string for EventSource clients"""
+    if request.method == 'GET':
+        return request.query_params.get('prompt', '')
+    data = await request.json()
+    return data.get('prompt', '')
+
+# API endpoint for chat
+@api.post('/api/chat')
+async def chat(request: Request):
+    try:
+        prompt = await read_prompt(request)
+        response = await llm_router.chat([{'role': 'user', 'content': prompt}], options=CHAT_OPTIONS)
+        return {'response': response}
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+# Streaming chat endpoint (server-sent events)
+@api.api_route('/api/chat/stream', methods=['GET', 'POST'])
+async def chat_stream(request: Request):
+    prompt = await read_prompt(request)
+
+    async def events():
+        try:
+            async for token in llm_router.stream([{'role': 'user', 'content': prompt}], options=CHAT_OPTIONS):
+                yield f"data: {json.dumps({'token': token})}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            logger.error(f"Chat stream failed: {e}")
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    return StreamingResponse(events(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+api.mount('/', WSGIMiddleware(app))
+
+# Socket.IO handles /socket.io/ (polling and WebSocket) itself, everything else goes to the FastAPI app
+asgi_app = socketio.ASGIApp(sio, other_asgi_app=api)
+
+def run_server():
     port = int(os.environ.get('PORT', 5000))
-    socketio.run(app, host='0.0.0.0', port=port, debug=False, use_reloader=False)
+    uvicorn.run(asgi_app, host='0.0.0.0', port=port)
 
 if __name__ == '__main__':
-    # Start Flask-SocketIO in a separate thread
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
-    
     try:
-        # Keep the main thread alive
-        while True:
-            time.sleep(1)
+        run_server()
     except KeyboardInterrupt:
         logger.info("Shutting down...")
-        os._exit(0)
@@ -0,0 +1,191 @@
+import os
+import sys
+import json
+import mmap
+import random
+import struct
+import argparse
+from array import array
+from itertools import product
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Word corpus settings
+HANGMAN_CORPUS = os.getenv('HANGMAN_CORPUS', 'words.idx')  # Built with `python words.py build`
+
+MAGIC = b'HGWC'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI')  # Magic, version, reserved, directory length
+DIFFICULTIES = ('easy', 'medium', 'hard')
+ANY = '*'
+LETTER_ORDER = 'ETAOINSHRDLCUMWFGYPBVKJXQZ'  # English letters from most to least common
+
+
+def difficulty_score(word: str) -> float:
+    """Higher is harder: short words with few distinct, uncommon letters give away little per guess"""
+    letters = set(word)
+    rarity = sum(LETTER_ORDER.index(letter) / 25 if letter in LETTER_ORDER else 1.0 for letter in letters)
+    return rarity / len(letters) + 3 / len(letters)
+
+
+def filter_key(category: str = ANY, difficulty: str = ANY, length=ANY) -> str:
+    return f"{category}|{difficulty}|{length}"
+
+
+def load_word_lists(directory: str) -> Dict[str, List[str]]:
+    """Read `<category>.txt` files with one word per line"""
+    categories = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.txt'):
+            with open(os.path.join(directory, name), encoding='utf-8') as f:
+                categories[name[:-len('.txt')]] = [line.strip() for line in f]
+    return categories
+
+
+def build_corpus(categories: Dict[str, Iterable[str]], path: str) -> int:
+    """Write words to an indexed corpus file and return how many were stored.
+
+    Layout: header, JSON directory, a u32 offset table, the UTF-8 words and
+    one u32 posting list of word numbers for every combination of category,
+    difficulty and length, each of which may also be "any".
+    """
+    entries: List[Tuple[str, str]] = []
+    for category, words in categories.items():
+        unique = {word.strip().upper() for word in words}
+        entries.extend((category, word) for word in sorted(unique) if word.isalpha() and 3 <= len(word) <= 64)
+    if not entries:
+        raise ValueError("No usable words")
+
+    # Difficulty is the word's tercile of difficulty_score across the whole corpus
+    scores = sorted(difficulty_score(word) for _, word in entries)
+    thresholds = (scores[len(scores) // 3], scores[2 * len(scores) // 3])
+    words, postings = [], {}
+    for number, (category, word) in enumerate(entries):
+        score = difficulty_score(word)
+        difficulty = DIFFICULTIES[(score > thresholds[0]) + (score > thresholds[1])]
+        words.append(word.encode('utf-8'))
+        for key in product((category, ANY), (difficulty, ANY), (len(word), ANY)):
+            postings.setdefault(filter_key(*key), array('I')).append(number)
+
+    offsets = array('I', [0])
+    for word in words:
+        offsets.append(offsets[-1] + len(word))
+    blob = b''.join(words)
+
+    # Sections are placed after the directory, so lay them out relative to its end first
+    sections, layout, position = {}, [], 0
+    def place(name, data: bytes):
+        nonlocal position
+        position += -position % 4  # Keep u32 arrays aligned
+        layout.append((position, data))
+        sections[name] = [position, len(data)]
+        position += len(data)
+    place('offsets', offsets.tobytes())
+    place('blob', blob)
+    for key, numbers in postings.items():
+        place(key, numbers.tobytes())
+
+    directory = json.dumps({
+        'words': len(words),
+        'byteorder': sys.byteorder,
+        'categories': sorted(categories),
+        'sections': sections
+    }).encode('utf-8')
+    base = HEADER.size + len(directory)
+    base += -base % 4
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(directory)))
+        f.write(directory)
+        for offset, data in layout:
+            f.seek(base + offset)
+            f.write(data)
+    os.replace(tmp_path, path)
+    return len(words)
+
+
+class WordCorpus:
+    """Read-only view of a corpus file built by build_corpus.
+
+    The file is memory-mapped, so words and indexes stay in the shared page
+    cache instead of each process's heap. Picking a random word for any
+    filter is one lookup in that filter's posting list.
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, directory_length = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a word corpus file")
+        directory = json.loads(self.map[HEADER.size:HEADER.size + directory_length])
+        if directory['byteorder'] != sys.byteorder:
+            raise ValueError(f"{path} was built on a machine with a different byte order")
+
+        self.base = HEADER.size + directory_length
+        self.base += -self.base % 4
+        self.count = directory['words']
+        self.categories: List[str] = directory['categories']
+        self.sections: Dict[str, List[int]] = directory['sections']
+        self.view = memoryview(self.map)
+        self.offsets = self._section('offsets').cast('I')
+        self.blob = self._section('blob')
+        self.lengths = sorted({int(key.rsplit('|', 1)[1]) for key in self.sections
+                               if key.startswith(f"{ANY}|{ANY}|") and not key.endswith(ANY)})
+
+    def __len__(self):
+        return self.count
+
+    def _section(self, name: str) -> memoryview:
+        offset, size = self.sections[name]
+        return self.view[self.base + offset:self.base + offset + size]
+
+    def word(self, number: int) -> str:
+        return bytes(self.blob[self.offsets[number]:self.offsets[number + 1]]).decode('utf-8')
+
+    def count_matching(self, category: Optional[str] = None, difficulty: Optional[str] = None,
+                       length: Optional[int] = None) -> int:
+        key = filter_key(category or ANY, difficulty or ANY, ANY if length is None else length)
+        return self.sections[key][1] // 4 if key in self.sections else 0
+
+    def random_word(self, category: Optional[str] = None, difficulty: Optional[str] = None,
+                    length: Optional[int] = None) -> Optional[str]:
+        """A random word matching every given filter, or None if there is none"""
+        key = filter_key(category or ANY, difficulty or ANY, ANY if length is None else length)
+        if key not in self.sections:
+            return None
+        numbers = self._section(key).cast('I')
+        return self.word(numbers[random.randrange(len(numbers))])
+
+    def close(self):
+        self.offsets.release()
+        self.blob.release()
+        self.view.release()
+        self.map.close()
+
+
+def load_corpus(path: str = HANGMAN_CORPUS) -> Optional[WordCorpus]:
+    """Open the configured corpus, or return None so callers fall back to the built-in words"""
+    if not os.path.exists(path):
+        return None
+    try:
+        return WordCorpus(path)
+    except (OSError, ValueError) as e:
+        print(f"Could not load word corpus {path}: {e}")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a Hangman word corpus")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    build = subcommands.add_parser('build', help="Index a directory of <category>.txt word lists")
+    build.add_argument('source', help="Directory with one word per line in each <category>.txt")
+    build.add_argument('output', nargs='?', default=HANGMAN_CORPUS)
+    args = parser.parse_args()
+
+    count = build_corpus(load_word_lists(args.source), args.output)
+    print(f"Indexed {count} words into {args.output}")
+
+
+if __name__ == "__main__":
+    main()